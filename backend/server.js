@@ -1,46 +1,51 @@
 const express = require('express');
 const cors = require('cors');
-const axios = require('axios'); // You'll need to install axios: npm install axios
 const app = express();
 
 // **IMPORTANT**: This is the Web app URL you got from Google Apps Script.
 // It has been updated with the URL you provided.
-const GOOGLE_APPS_SCRIPT_API_URL = 'https://script.google.com/macros/s/AKfycbw3mJyy7dZj2NqPJ-VWLTUVbpEYGc-FRU9MzxTIV6GguXlIh59PERCmrJx6De43voRt/exec';
+const GOOGLE_APPS_SCRIPT_API_URL = process.env.POSTERS_SOURCE_URL || 'https://script.google.com/macros/s/AKfycbw3mJyy7dZj2NqPJ-VWLTUVbpEYGc-FRU9MzxTIV6GguXlIh59PERCmrJx6De43voRt/exec';
 
-// A simple cache to avoid hitting the Apps Script too often
-let cachedPosters = [];
-let lastFetchTime = 0;
-const CACHE_DURATION = 5 * 60 * 1000; // Cache for 5 minutes (adjust as needed)
+// How long the poster list is served without refreshing it (5 minutes by default).
+// After that it is still served while a fresh copy is fetched in the background.
+const CACHE_DURATION = Number(process.env.POSTERS_CACHE_TTL_MS) || 5 * 60 * 1000;
 
 app.use(cors()); // Allow all CORS for now, will refine later if needed
 
-app.get('/api/posters', async (req, res) => {
-  const currentTime = Date.now();
-
-  // Check if cache is still valid
-  if (cachedPosters.length > 0 && (currentTime - lastFetchTime < CACHE_DURATION)) {
-    console.log('Serving posters from cache.');
-    return res.json(cachedPosters);
-  }
-
-  console.log('Fetching posters from Google Apps Script...');
-  try {
-    const response = await axios.get(GOOGLE_APPS_SCRIPT_API_URL);
-    cachedPosters = response.data;
-    lastFetchTime = currentTime;
-    res.json(cachedPosters);
-  } catch (error) {
-    console.error('Error fetching posters from Google Apps Script:', error.message);
-    // If there's an error, try to serve from cache if available, or send empty/error
-    if (cachedPosters.length > 0) {
-      console.log('Serving old cached posters due to fetch error.');
-      res.json(cachedPosters);
-    } else {
-      res.status(500).json({ message: 'Could not retrieve posters.' });
-    }
-  }
-});
+const start = async () => {
+  // The poster catalogue and the instrumentation are shared with the main API
+  // server. They are ES modules (src/api/package.json sets "type": "module"), so
+  // the backend has to be deployed from a full checkout of the repository.
+  const { PosterCatalogue, createJsonPosterSource } = await import('../src/api/posterCatalogue.js');
+  const { instrumentRequests } = await import('../src/api/instrumentation.js');
+  const { logger } = await import('../src/api/logger.js');
+  const { metrics } = await import('../src/api/metrics.js');
+  const { traceSpan } = await import('../src/api/tracing.js');
+
+  // Per-route latency and payload size metrics, request tracing and sampled request logs.
+  app.use(instrumentRequests());
+
+  const appsScriptSource = createJsonPosterSource({ url: GOOGLE_APPS_SCRIPT_API_URL });
+  const posterCatalogue = new PosterCatalogue({
+    source: () => traceSpan('apps-script.fetch', {}, appsScriptSource),
+    ttlMs: CACHE_DURATION,
+  });
+  posterCatalogue.registerMetrics(metrics);
+
+  // Serves the cached posters; supports `?page=&limit=` pagination and ETag revalidation.
+  app.get('/api/posters', posterCatalogue.handler());
 
-// Use the port provided by the environment (e.g., Render) or default to 5000 for local testing
-const PORT = process.env.PORT || 5000;
-app.listen(PORT, () => console.log(`Backend running on port ${PORT}`));
\ No newline at end of file
+  // Prometheus-style metrics: latency histograms, payload sizes, poster cache hit
+  // ratio, upstream call durations, event-loop delay, heap/RSS.
+  app.get('/metrics', metrics.handler());
+
+  // Use the port provided by the environment (e.g., Render) or default to 5000 for local testing
+  const PORT = process.env.PORT || 5000;
+  app.listen(PORT, () => logger.info('Backend running', { port: Number(PORT) }));
+};
+
+start().catch((error) => {
+  // Plain console: the shared logger may be what failed to load.
+  console.error('Failed to start backend:', error);
+  process.exit(1);
+});
@@ -0,0 +1,93 @@
+// Compares two benchmark result files written by run.js.
+//
+// Usage:
+//   npm run bench:compare                         (the two most recent results)
+//   npm run bench:compare -- base.json head.json
+//   npm run bench:compare -- --threshold=15
+//
+// Runs are matched by name (scenario/size/concurrency). A run counts as a
+// regression when its p95 latency grows, or its throughput drops, by more than
+// the threshold (10% by default). The script exits with status 1 if any run
+// regressed, so it can gate CI.
+const fs = require('fs');
+const path = require('path');
+
+const RESULTS_DIR = path.join(__dirname, 'results');
+// Latency changes smaller than this are treated as noise regardless of percentage.
+const MIN_LATENCY_DELTA_MS = 1;
+
+const change = (base, head) => (base ? ((head - base) / base) * 100 : 0);
+
+const formatChange = (base, head) => {
+  const percent = change(base, head);
+  return `${base} -> ${head} (${percent >= 0 ? '+' : ''}${percent.toFixed(1)}%)`;
+};
+
+const latestResults = () => fs.readdirSync(RESULTS_DIR)
+  .filter((file) => file.endsWith('.json'))
+  .sort()
+  .slice(-2)
+  .map((file) => path.join(RESULTS_DIR, file));
+
+const main = () => {
+  const args = process.argv.slice(2);
+  const thresholdArg = args.find((arg) => arg.startsWith('--threshold='));
+  const threshold = thresholdArg ? Number(thresholdArg.split('=')[1]) : 10;
+  let files = args.filter((arg) => !arg.startsWith('--'));
+  if (files.length === 0) {
+    files = latestResults();
+  }
+  if (files.length !== 2) {
+    throw new Error('Need two result files to compare (run `npm run bench` twice, or pass them explicitly).');
+  }
+
+  const [base, head] = files.map((file) => JSON.parse(fs.readFileSync(file, 'utf8')));
+  const describe = (report, file) => `${path.basename(file)} (${report.git.commit ? report.git.commit.slice(0, 7) : 'unknown'}${report.git.dirty ? ', dirty' : ''})`;
+  console.log(`base: ${describe(base, files[0])}`);
+  console.log(`head: ${describe(head, files[1])}\n`);
+
+  const baseRuns = new Map(base.results.map((result) => [result.name, result]));
+  const regressions = [];
+
+  for (const result of head.results) {
+    const previous = baseRuns.get(result.name);
+    if (!previous) {
+      console.log(`${result.name}: new run, nothing to compare`);
+      continue;
+    }
+
+    const p95Change = change(previous.latencyMs.p95, result.latencyMs.p95);
+    const throughputChange = change(previous.okPerSecond, result.okPerSecond);
+    const regressed = (p95Change > threshold &&
+      result.latencyMs.p95 - previous.latencyMs.p95 >= MIN_LATENCY_DELTA_MS) ||
+      throughputChange < -threshold;
+    if (regressed) {
+      regressions.push(result.name);
+    }
+
+    console.log(`${regressed ? 'REGRESSED ' : ''}${result.name}`);
+    console.log(`  ok req/s  ${formatChange(previous.okPerSecond, result.okPerSecond)}`);
+    console.log(`  p50 ms    ${formatChange(previous.latencyMs.p50, result.latencyMs.p50)}`);
+    console.log(`  p95 ms    ${formatChange(previous.latencyMs.p95, result.latencyMs.p95)}`);
+    console.log(`  p99 ms    ${formatChange(previous.latencyMs.p99, result.latencyMs.p99)}`);
+    if (previous.peakRssBytes && result.peakRssBytes) {
+      console.log(`  rss MB    ${formatChange(Math.round(previous.peakRssBytes / 1048576), Math.round(result.peakRssBytes / 1048576))}`);
+    }
+    if (previous.errors || result.errors) {
+      console.log(`  errors    ${previous.errors} -> ${result.errors}`);
+    }
+  }
+
+  if (regressions.length > 0) {
+    console.log(`\n${regressions.length} run(s) regressed by more than ${threshold}%.`);
+    process.exit(1);
+  }
+  console.log(`\nNo regressions above ${threshold}%.`);
+};
+
+try {
+  main();
+} catch (error) {
+  console.error('Comparison failed:', error.message);
+  process.exit(1);
+}
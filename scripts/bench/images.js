@@ -0,0 +1,62 @@
+// Test images for the benchmarks: a product-shot style photo (a textured subject
+// on a plain background) at a few typical upload sizes.
+const sharp = require('sharp');
+
+const IMAGE_SIZES = {
+  small: { width: 640, height: 480 },
+  medium: { width: 1920, height: 1080 },
+  large: { width: 4000, height: 3000 },
+};
+
+const createImage = async ({ width, height }) => {
+  const subject = await sharp({
+    create: {
+      width: Math.round(width / 2),
+      height: Math.round(height / 2),
+      channels: 3,
+      background: '#b04030',
+      noise: { type: 'gaussian', mean: 128, sigma: 40 },
+    },
+  }).png().toBuffer();
+
+  return sharp({
+    create: { width, height, channels: 3, background: '#f4f4f4' },
+  })
+    .composite([{ input: subject, left: Math.round(width / 4), top: Math.round(height / 4) }])
+    .jpeg({ quality: 85 })
+    .toBuffer();
+};
+
+/**
+ * Builds the JPEG test image for each requested size name.
+ *
+ * @param {string[]} names - Keys of IMAGE_SIZES.
+ * @returns {Promise<object>} name -> { width, height, buffer }
+ */
+const createImages = async (names) => {
+  const images = {};
+  for (const name of names) {
+    const size = IMAGE_SIZES[name];
+    if (!size) {
+      throw new Error(`Unknown image size "${name}". Use one of: ${Object.keys(IMAGE_SIZES).join(', ')}.`);
+    }
+    images[name] = { ...size, buffer: await createImage(size) };
+  }
+  return images;
+};
+
+/**
+ * Returns a copy of a JPEG with a numbered comment segment after the SOI marker.
+ * The pixels are identical, but the bytes (and so the content hash) differ, which
+ * keeps the server's result cache from answering repeated benchmark requests.
+ */
+const uniqueJpeg = (buffer, n) => {
+  const text = Buffer.from(`bench-${n}`);
+  const segment = Buffer.alloc(4 + text.length);
+  segment.writeUInt16BE(0xfffe, 0); // COM marker
+  segment.writeUInt16BE(text.length + 2, 2);
+  text.copy(segment, 4);
+  return Buffer.concat([buffer.subarray(0, 2), segment, buffer.subarray(2)]);
+};
+
+module.exports = { IMAGE_SIZES, createImages, uniqueJpeg };
@@ -0,0 +1,103 @@
+// Closed-loop HTTP load generator: `concurrency` clients each send a request,
+// wait for the full response, and immediately send the next one.
+const http = require('http');
+
+const percentile = (sorted, p) => {
+  if (sorted.length === 0) {
+    return 0;
+  }
+  return sorted[Math.min(sorted.length - 1, Math.ceil((p / 100) * sorted.length) - 1)];
+};
+
+const round = (value) => Math.round(value * 100) / 100;
+
+const send = (agent, baseUrl, { method = 'GET', path, headers = {}, body }) => new Promise((resolve) => {
+  const start = process.hrtime.bigint();
+  const req = http.request(new URL(path, baseUrl), {
+    method,
+    agent,
+    headers: body ? { ...headers, 'Content-Length': body.length } : headers,
+  }, (res) => {
+    let bytes = 0;
+    res.on('data', (chunk) => {
+      bytes += chunk.length;
+    });
+    res.on('end', () => resolve({
+      status: res.statusCode,
+      bytes,
+      ms: Number(process.hrtime.bigint() - start) / 1e6,
+    }));
+  });
+  req.on('error', (error) => resolve({
+    status: error.code || 'ERROR',
+    bytes: 0,
+    ms: Number(process.hrtime.bigint() - start) / 1e6,
+  }));
+  req.end(body);
+});
+
+/**
+ * Runs one load level against a server.
+ *
+ * @param {object} options
+ * @param {string} options.baseUrl - e.g. http://127.0.0.1:5000
+ * @param {function} options.makeRequest - (n) => { method, path, headers, body } for the n-th request.
+ * @param {number} options.concurrency - Number of clients sending in parallel.
+ * @param {number} options.durationMs - How long to keep sending.
+ * @param {number} [options.warmupRequests] - Requests sent (and not measured) before the run.
+ * @returns {Promise<object>} Latency percentiles (ms), throughput and status counts.
+ */
+const runLoad = async ({ baseUrl, makeRequest, concurrency, durationMs, warmupRequests = 0 }) => {
+  const agent = new http.Agent({ keepAlive: true, maxSockets: concurrency });
+  let n = 0;
+
+  for (let i = 0; i < warmupRequests; i++) {
+    await send(agent, baseUrl, makeRequest(n++));
+  }
+
+  const latencies = [];
+  const statuses = {};
+  let bytesSent = 0;
+  let bytesReceived = 0;
+  const start = Date.now();
+  const deadline = start + durationMs;
+
+  const client = async () => {
+    while (Date.now() < deadline) {
+      const request = makeRequest(n++);
+      const result = await send(agent, baseUrl, request);
+      latencies.push(result.ms);
+      statuses[result.status] = (statuses[result.status] || 0) + 1;
+      bytesSent += request.body ? request.body.length : 0;
+      bytesReceived += result.bytes;
+    }
+  };
+  await Promise.all(Array.from({ length: concurrency }, client));
+
+  const elapsedMs = Date.now() - start;
+  agent.destroy();
+
+  const sorted = latencies.sort((a, b) => a - b);
+  const ok = Object.keys(statuses)
+    .filter((status) => status >= 200 && status < 400)
+    .reduce((sum, status) => sum + statuses[status], 0);
+  return {
+    requests: sorted.length,
+    errors: sorted.length - ok,
+    statuses,
+    durationMs: elapsedMs,
+    requestsPerSecond: round((sorted.length * 1000) / elapsedMs),
+    okPerSecond: round((ok * 1000) / elapsedMs),
+    latencyMs: {
+      mean: round(sorted.reduce((sum, ms) => sum + ms, 0) / (sorted.length || 1)),
+      p50: round(percentile(sorted, 50)),
+      p95: round(percentile(sorted, 95)),
+      p99: round(percentile(sorted, 99)),
+      max: round(sorted[sorted.length - 1] || 0),
+    },
+    bytesSent,
+    bytesReceived,
+  };
+};
+
+module.exports = { runLoad, percentile };
@@ -0,0 +1,376 @@
+// Load-test and benchmark suite for the Express API servers.
+//
+// Starts server.js and backend/server.js locally, with the Cloudinary Search API
+// and the Google Apps Script feed replaced by local stubs (see upstreams.js), and
+// drives the image and poster routes at several image sizes and concurrency
+// levels. For every run it records p50/p95/p99 latency, throughput, peak RSS and
+// event-loop delay, and writes everything to scripts/bench/results/ as JSON so
+// runs can be compared between commits with `npm run bench:compare`.
+//
+// Usage:
+//   npm run bench
+//   npm run bench -- --quick
+//   npm run bench -- --scenarios=resize-image,posters --sizes=large --concurrency=1,8 --duration=10
+//
+// Options:
+//   --scenarios=a,b    Scenarios to run (default: all, see SCENARIOS below). Scenarios
+//                      this machine cannot run are skipped and listed in the results.
+//   --sizes=a,b        Image sizes: small, medium, large (default: small,medium).
+//   --concurrency=a,b  Concurrent clients per run (default: 1,4,16).
+//   --duration=s       Seconds per run (default: 5).
+//   --posters=n        Posters listed by the stubbed upstreams (default: 300).
+//   --upstream-latency=ms  Delay added by the stubbed upstreams (default: 80).
+//   --out=path         Where to write the results (default: results/<date>-<commit>.json).
+//   --quick            Short smoke run: small images, concurrency 1 and 4, 2 seconds.
+//
+// Other environment variables (e.g. IMAGE_JOB_CONCURRENCY) are passed through to
+// the servers, so configurations can be benchmarked side by side.
+const { spawn, execSync } = require('child_process');
+const fs = require('fs');
+const net = require('net');
+const os = require('os');
+const path = require('path');
+const { startUpstreams } = require('./upstreams');
+const { createImages, uniqueJpeg } = require('./images');
+const { runLoad } = require('./loadgen');
+
+const ROOT = path.resolve(__dirname, '../..');
+const RESULTS_DIR = path.join(__dirname, 'results');
+const SAMPLE_INTERVAL_MS = 250;
+
+// Each scenario targets one server. Image scenarios run once per image size and
+// send a unique copy of the image with every request, so they measure real
+// processing; the "-cached" variant resends the same bytes to measure cache hits.
+const SCENARIOS = {
+  upload: {
+    server: 'api',
+    image: true,
+    request: (image, n) => ({
+      method: 'POST',
+      path: '/api/upload?include_data=false',
+      headers: { 'Content-Type': 'image/jpeg', Accept: 'application/json' },
+      body: uniqueJpeg(image.buffer, n),
+    }),
+  },
+  'resize-image': {
+    server: 'api',
+    image: true,
+    request: (image, n) => ({
+      method: 'POST',
+      path: '/api/resize-image?width=800&height=600',
+      headers: { 'Content-Type': 'image/jpeg', Accept: 'image/png' },
+      body: uniqueJpeg(image.buffer, n),
+    }),
+  },
+  'resize-image-cached': {
+    server: 'api',
+    image: true,
+    request: (image) => ({
+      method: 'POST',
+      path: '/api/resize-image?width=800&height=600',
+      headers: { 'Content-Type': 'image/jpeg', Accept: 'image/png' },
+      body: image.buffer,
+    }),
+  },
+  'edit-background': {
+    server: 'api',
+    image: true,
+    request: (image, n) => ({
+      method: 'POST',
+      path: '/api/edit-background?color=%23ffffff',
+      headers: { 'Content-Type': 'image/jpeg', Accept: 'image/png' },
+      body: uniqueJpeg(image.buffer, n),
+    }),
+  },
+  // Background removal per mode, so each mode's latency and throughput are recorded.
+  // The segment scenario needs a model, so it only runs when SEGMENTATION_MODEL_PATH is set.
+  'remove-background-colorkey': {
+    server: 'api',
+    image: true,
+    request: (image, n) => ({
+      method: 'POST',
+      path: '/api/remove-background?mode=colorkey',
+      headers: { 'Content-Type': 'image/jpeg', Accept: 'image/png' },
+      body: uniqueJpeg(image.buffer, n),
+    }),
+  },
+  'remove-background-segment': {
+    server: 'api',
+    image: true,
+    skip: () => (process.env.SEGMENTATION_MODEL_PATH ? null : 'SEGMENTATION_MODEL_PATH is not set'),
+    request: (image, n) => ({
+      method: 'POST',
+      path: '/api/remove-background?mode=segment',
+      headers: { 'Content-Type': 'image/jpeg', Accept: 'image/png' },
+      body: uniqueJpeg(image.buffer, n),
+    }),
+  },
+  posters: {
+    server: 'api',
+    request: () => ({ path: '/api/posters' }),
+  },
+  'posters-page': {
+    server: 'api',
+    request: () => ({ path: '/api/posters?page=2&limit=24' }),
+  },
+  'backend-posters': {
+    server: 'backend',
+    request: () => ({ path: '/api/posters' }),
+  },
+};
+
+const parseArgs = (argv) => {
+  const args = {};
+  for (const arg of argv) {
+    const [key, value] = arg.replace(/^--/, '').split('=');
+    args[key] = value === undefined ? true : value;
+  }
+  const list = (value, fallback) => (value ? String(value).split(',').filter(Boolean) : fallback);
+
+  const quick = Boolean(args.quick);
+  const options = {
+    scenarios: list(args.scenarios, Object.keys(SCENARIOS)),
+    sizes: list(args.sizes, quick ? ['small'] : ['small', 'medium']),
+    concurrency: list(args.concurrency, quick ? ['1', '4'] : ['1', '4', '16']).map(Number),
+    durationMs: (Number(args.duration) || (quick ? 2 : 5)) * 1000,
+    posters: Number(args.posters) || 300,
+    upstreamLatencyMs: args['upstream-latency'] !== undefined ? Number(args['upstream-latency']) : 80,
+    out: args.out || null,
+  };
+
+  for (const name of options.scenarios) {
+    if (!SCENARIOS[name]) {
+      throw new Error(`Unknown scenario "${name}". Use one of: ${Object.keys(SCENARIOS).join(', ')}.`);
+    }
+  }
+  if (options.concurrency.some((value) => !(value > 0))) {
+    throw new Error('--concurrency must be a list of positive numbers.');
+  }
+  return options;
+};
+
+const freePort = () => new Promise((resolve, reject) => {
+  const server = net.createServer();
+  server.on('error', reject);
+  server.listen(0, '127.0.0.1', () => {
+    const { port } = server.address();
+    server.close(() => resolve(port));
+  });
+});
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Starts a server script and resolves once `readyPath` answers.
+const startServer = async (name, script, readyPath, env) => {
+  const port = await freePort();
+  const child = spawn(process.execPath, ['--no-warnings', script], {
+    cwd: ROOT,
+    env: { ...process.env, ...env, PORT: String(port) },
+    stdio: ['ignore', 'ignore', 'pipe'],
+  });
+  let stderr = '';
+  child.stderr.on('data', (chunk) => {
+    stderr = (stderr + chunk).slice(-4000);
+  });
+
+  const url = `http://127.0.0.1:${port}`;
+  for (let attempt = 0; attempt < 100; attempt++) {
+    if (child.exitCode !== null) {
+      break;
+    }
+    try {
+      const response = await fetch(`${url}${readyPath}`);
+      if (response.ok) {
+        return { name, url, child, stop: () => child.kill() };
+      }
+    } catch (error) {
+      // Not listening yet.
+    }
+    await sleep(100);
+  }
+  child.kill();
+  throw new Error(`${name} server did not start.\n${stderr}`);
+};
+
+// Resident set size of a process from /proc (Linux only), in bytes.
+const procRss = (pid) => {
+  try {
+    const status = fs.readFileSync(`/proc/${pid}/status`, 'utf8');
+    const match = status.match(/VmRSS:\s+(\d+) kB/);
+    return match ? Number(match[1]) * 1024 : null;
+  } catch (error) {
+    return null;
+  }
+};
+
+// Samples memory and event-loop delay of a server while a run is in progress.
+// server.js reports both through /api/stats; for the backend only RSS is available.
+const startSampler = (server) => {
+  const peak = { rssBytes: null, eventLoopDelayP99Ms: null, eventLoopDelayMaxMs: null };
+  const max = (current, value) => (value === null || value === undefined ? current : Math.max(current || 0, value));
+
+  const sample = async () => {
+    if (server.name === 'api') {
+      try {
+        const stats = await (await fetch(`${server.url}/api/stats?reset=event-loop`)).json();
+        peak.rssBytes = max(peak.rssBytes, stats.memory.rss);
+        peak.eventLoopDelayP99Ms = max(peak.eventLoopDelayP99Ms, stats.eventLoopDelay.p99Ms);
+        peak.eventLoopDelayMaxMs = max(peak.eventLoopDelayMaxMs, stats.eventLoopDelay.maxMs);
+        return;
+      } catch (error) {
+        // Fall back to /proc when the stats request fails under load.
+      }
+    }
+    peak.rssBytes = max(peak.rssBytes, procRss(server.child.pid));
+  };
+
+  // Start a fresh event-loop delay window for this run.
+  let running = sample();
+  const timer = setInterval(() => {
+    running = running.then(sample);
+  }, SAMPLE_INTERVAL_MS);
+
+  return async () => {
+    clearInterval(timer);
+    await running;
+    await sample();
+    return peak;
+  };
+};
+
+const gitInfo = () => {
+  const git = (command) => {
+    try {
+      return execSync(`git ${command}`, { cwd: ROOT, stdio: ['ignore', 'pipe', 'ignore'] }).toString().trim();
+    } catch (error) {
+      return null;
+    }
+  };
+  return {
+    commit: git('rev-parse HEAD'),
+    subject: git('log -1 --format=%s'),
+    dirty: Boolean(git('status --porcelain --untracked-files=no')),
+  };
+};
+
+const formatRow = (result) => [
+  result.name.padEnd(36),
+  String(result.requestsPerSecond).padStart(8),
+  String(result.latencyMs.p50).padStart(9),
+  String(result.latencyMs.p95).padStart(9),
+  String(result.latencyMs.p99).padStart(9),
+  String(result.errors).padStart(7),
+  (result.peakRssBytes ? `${Math.round(result.peakRssBytes / 1048576)}MB` : '-').padStart(8),
+  (result.eventLoopDelayP99Ms !== null ? String(Math.round(result.eventLoopDelayP99Ms * 10) / 10) : '-').padStart(8),
+].join(' ');
+
+const main = async () => {
+  const options = parseArgs(process.argv.slice(2));
+  const skipped = {};
+  options.scenarios = options.scenarios.filter((name) => {
+    const reason = SCENARIOS[name].skip && SCENARIOS[name].skip();
+    if (reason) {
+      skipped[name] = reason;
+      console.log(`Skipping ${name}: ${reason}.`);
+    }
+    return !reason;
+  });
+  const upstreams = await startUpstreams({ posters: options.posters, latencyMs: options.upstreamLatencyMs });
+  const servers = {};
+
+  try {
+    const needs = new Set(options.scenarios.map((name) => SCENARIOS[name].server));
+    if (needs.has('api')) {
+      servers.api = await startServer('api', 'server.js', '/', {
+        CLOUDINARY_API_PREFIX: upstreams.url,
+      });
+    }
+    if (needs.has('backend')) {
+      servers.backend = await startServer('backend', path.join('backend', 'server.js'), '/api/posters', {
+        POSTERS_SOURCE_URL: `${upstreams.url}/apps-script`,
+      });
+    }
+
+    const images = options.scenarios.some((name) => SCENARIOS[name].image)
+      ? await createImages(options.sizes)
+      : {};
+
+    console.log(`${'run'.padEnd(36)} ${'req/s'.padStart(8)} ${'p50 ms'.padStart(9)} ${'p95 ms'.padStart(9)} ${'p99 ms'.padStart(9)} ${'errors'.padStart(7)} ${'rss'.padStart(8)} ${'loop ms'.padStart(8)}`);
+
+    const results = [];
+    for (const scenarioName of options.scenarios) {
+      const scenario = SCENARIOS[scenarioName];
+      const server = servers[scenario.server];
+      const sizes = scenario.image ? options.sizes : [null];
+
+      for (const size of sizes) {
+        for (const concurrency of options.concurrency) {
+          const image = size ? images[size] : null;
+          const stopSampler = startSampler(server);
+          const load = await runLoad({
+            baseUrl: server.url,
+            makeRequest: (n) => scenario.request(image, n),
+            concurrency,
+            durationMs: options.durationMs,
+            // Fills the poster caches and loads sharp before measuring.
+            warmupRequests: 2,
+          });
+          const peak = await stopSampler();
+
+          const result = {
+            name: [scenarioName, size, `c${concurrency}`].filter(Boolean).join('/'),
+            scenario: scenarioName,
+            server: scenario.server,
+            size,
+            imageBytes: image ? image.buffer.length : null,
+            concurrency,
+            ...load,
+            peakRssBytes: peak.rssBytes,
+            eventLoopDelayP99Ms: peak.eventLoopDelayP99Ms,
+            eventLoopDelayMaxMs: peak.eventLoopDelayMaxMs,
+          };
+          results.push(result);
+          console.log(formatRow(result));
+        }
+      }
+    }
+
+    let serverStats = null;
+    if (servers.api) {
+      serverStats = await (await fetch(`${servers.api.url}/api/stats`)).json();
+    }
+
+    const git = gitInfo();
+    const report = {
+      date: new Date().toISOString(),
+      git,
+      environment: {
+        node: process.version,
+        platform: `${os.platform()} ${os.release()}`,
+        cpus: os.cpus().length,
+        cpuModel: os.cpus()[0] ? os.cpus()[0].model : null,
+        totalMemoryBytes: os.totalmem(),
+      },
+      options,
+      skipped,
+      upstreams: upstreams.counters,
+      results,
+      serverStats,
+    };
+
+    const out = options.out
+      ? path.resolve(options.out)
+      : path.join(RESULTS_DIR, `${report.date.replace(/[:.]/g, '-')}-${(git.commit || 'unknown').slice(0, 7)}${git.dirty ? '-dirty' : ''}.json`);
+    fs.mkdirSync(path.dirname(out), { recursive: true });
+    fs.writeFileSync(out, `${JSON.stringify(report, null, 2)}\n`);
+    console.log(`\nResults written to ${path.relative(process.cwd(), out)}`);
+  } finally {
+    Object.values(servers).forEach((server) => server.stop());
+    await upstreams.close();
+  }
+};
+
+main().catch((error) => {
+  console.error('Benchmark failed:', error.message);
+  process.exit(1);
+});
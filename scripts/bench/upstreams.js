@@ -0,0 +1,96 @@
+// Local stand-ins for the upstream services the API servers depend on, so
+// benchmarks never hit (or get rate limited by) the real ones.
+const http = require('http');
+
+const DEFAULT_POSTERS = 300;
+const DEFAULT_LATENCY_MS = 80;
+
+const makeResource = (i) => ({
+  public_id: `portfolio/bench_poster-${i}`,
+  version: 1700000000 + i,
+  format: 'jpg',
+  width: 1600,
+  height: 2400,
+  secure_url: `https://res.cloudinary.com/bench/image/upload/v${1700000000 + i}/portfolio/bench_poster-${i}.jpg`,
+});
+
+const makePoster = (i) => ({
+  id: `poster-${i}`,
+  title: `Bench Poster ${i}`,
+  imageUrl: `https://example.com/posters/${i}.jpg`,
+});
+
+/**
+ * Starts a stub for the Cloudinary Search API and the Google Apps Script poster feed
+ * on one local port.
+ *
+ * - POST /v1_1/<cloud>/resources/search answers like Cloudinary, paged with next_cursor.
+ * - GET /apps-script answers with the poster array the backend expects.
+ *
+ * @param {object} [options]
+ * @param {number} [options.posters] - How many posters each upstream lists.
+ * @param {number} [options.latencyMs] - Delay added to every upstream response.
+ * @returns {Promise<{ url: string, counters: object, close: function }>}
+ */
+const startUpstreams = ({ posters = DEFAULT_POSTERS, latencyMs = DEFAULT_LATENCY_MS } = {}) => {
+  const counters = { cloudinarySearches: 0, appsScriptRequests: 0 };
+
+  const server = http.createServer((req, res) => {
+    const chunks = [];
+    req.on('data', (chunk) => chunks.push(chunk));
+    req.on('end', () => {
+      setTimeout(() => {
+        if (req.method === 'POST' && /\/resources\/search$/.test(req.url)) {
+          counters.cloudinarySearches++;
+          let body = {};
+          try {
+            body = JSON.parse(Buffer.concat(chunks).toString() || '{}');
+          } catch (error) {
+            // The SDK always sends JSON; treat anything else as a first-page request.
+          }
+          const pageSize = Math.min(Number(body.max_results) || 500, 500);
+          const start = Number(body.next_cursor) || 0;
+          const end = Math.min(posters, start + pageSize);
+          const resources = [];
+          for (let i = start; i < end; i++) {
+            resources.push(makeResource(i));
+          }
+          res.writeHead(200, { 'Content-Type': 'application/json' });
+          res.end(JSON.stringify({
+            total_count: posters,
+            resources,
+            ...(end < posters ? { next_cursor: String(end) } : {}),
+          }));
+          return;
+        }
+
+        if (req.method === 'GET' && req.url.startsWith('/apps-script')) {
+          counters.appsScriptRequests++;
+          const list = [];
+          for (let i = 0; i < posters; i++) {
+            list.push(makePoster(i));
+          }
+          res.writeHead(200, { 'Content-Type': 'application/json' });
+          res.end(JSON.stringify(list));
+          return;
+        }
+
+        res.writeHead(404, { 'Content-Type': 'application/json' });
+        res.end(JSON.stringify({ error: { message: `No stub for ${req.method} ${req.url}` } }));
+      }, latencyMs);
+    });
+  });
+
+  return new Promise((resolve) => {
+    server.listen(0, '127.0.0.1', () => {
+      const { port } = server.address();
+      resolve({
+        url: `http://127.0.0.1:${port}`,
+        counters,
+        close: () => new Promise((done) => server.close(done)),
+      });
+    });
+  });
+};
+
+module.exports = { startUpstreams };
@@ -4,49 +4,164 @@ import express from 'express';
 import cors from 'cors';
 import multer from 'multer'; // Import multer
 import sharp from 'sharp'; // Import sharp
-import postersHandler from './src/api/posters.js'; // Existing handler
+import postersHandler, { posterCatalogue } from './src/api/posters.js'; // Existing handler
 
 // Import new image processing handlers
 import {
   uploadImageHandler,
+  getImageHandler,
   removeBackgroundHandler,
   editBackgroundHandler,
-  resizeImageHandler
+  resizeImageHandler,
+  transformImageHandler
 } from './src/api/imageProcessor.js';
+import { imageQueue, sharpThreadsPerJob } from './src/api/jobQueue.js';
+import { imageStore } from './src/api/imageStore.js';
+import { resultCache } from './src/api/resultCache.js';
+import { loadSegmentationModel, segmentationStats } from './src/api/segmentation.js';
+import { instrumentRequests } from './src/api/instrumentation.js';
+import { logger } from './src/api/logger.js';
+import { metrics, readEventLoopDelay } from './src/api/metrics.js';
 
 const app = express();
 const PORT = process.env.PORT || 5000;
 
+// Largest image we accept in a single request, in bytes.
+const MAX_UPLOAD_BYTES = Number(process.env.MAX_UPLOAD_BYTES) || 25 * 1024 * 1024;
+// Legacy base64 payloads are about a third larger than the image itself.
+const MAX_BASE64_BYTES = Math.ceil(MAX_UPLOAD_BYTES * 4 / 3) + 1024;
+
+// Split the cores between concurrent jobs rather than letting every sharp call
+// start a full libvips thread pool. The server runs as a single process: image
+// handles live in its memory, and libvips threads already spread jobs over the cores.
+sharp.concurrency(sharpThreadsPerJob());
+
 // Set up multer for handling file uploads in memory
 const upload = multer({
-  storage: multer.memoryStorage()
+  storage: multer.memoryStorage(),
+  limits: {
+    fileSize: MAX_UPLOAD_BYTES,
+    fieldSize: MAX_BASE64_BYTES, // multipart clients may still send base64 `image_data`
+    files: 2
+  }
 });
 
-// Middleware for parsing JSON bodies
-app.use(express.json());
+// Parses JSON bodies for the image routes (legacy base64 clients need a larger limit)
+const jsonBody = express.json({ limit: MAX_BASE64_BYTES });
+
+// Admits image requests only while the job queue has room, before any body is read.
+const admitImageJob = imageQueue.middleware();
+
+// Binary mode: clients can POST the image bytes directly as the request body.
+const rawImage = express.raw({
+  type: ['application/octet-stream', 'image/*'],
+  limit: MAX_UPLOAD_BYTES
+});
+
+// Multipart fields accepted by the image operations. `image` carries the image
+// being edited; `background_image` is only used by edit-background.
+const imageFields = upload.fields([
+  { name: 'image', maxCount: 1 },
+  { name: 'background_image', maxCount: 1 }
+]);
+
+// Per-route latency and payload size metrics, request tracing and sampled request logs.
+app.use(instrumentRequests());
 
 // Enable CORS for all requests.
 app.use(cors());
 
+// Queue, image store and result cache figures are mirrored into /metrics on every scrape.
+posterCatalogue.registerMetrics(metrics);
+metrics.onCollect((registry) => {
+  const queue = imageQueue.stats();
+  const jobs = registry.gauge('image_queue_jobs', 'Image jobs by state.', { labelNames: ['state'] });
+  jobs.set({ state: 'active' }, queue.active);
+  jobs.set({ state: 'waiting' }, queue.waiting);
+
+  const cache = resultCache.stats();
+  const lookups = registry.counter('image_result_cache_lookups_total',
+    'Image result cache lookups by result.', { labelNames: ['result'] });
+  lookups.set({ result: 'memory-hit' }, cache.memoryHits);
+  lookups.set({ result: 'disk-hit' }, cache.diskHits);
+  lookups.set({ result: 'miss' }, cache.misses);
+  registry.gauge('image_result_cache_bytes', 'Bytes held by the image result cache.').set({}, cache.bytes);
+  registry.gauge('image_store_bytes', 'Bytes held by the image store.').set({}, imageStore.stats().bytes);
+});
+
 // Define your API routes
 app.get('/api/posters', postersHandler); // Existing route
 
 // New routes for image processing
-// For image upload, use `upload.single('image')` middleware
-app.post('/api/upload', upload.single('image'), uploadImageHandler);
+// Every route accepts the image as a multipart `image` file, a raw binary body,
+// legacy base64 `image_data`, or the `image_handle` returned by a previous call.
+// Send `Accept: image/png` to get raw bytes back. When the server is saturated
+// they answer 429 (before reading the body) or 503, both with Retry-After.
+app.post('/api/upload', admitImageJob, jsonBody, rawImage, upload.single('image'), uploadImageHandler);
+app.get('/api/images/:handle', getImageHandler);
+app.post('/api/remove-background', admitImageJob, jsonBody, rawImage, imageFields, removeBackgroundHandler);
+app.post('/api/edit-background', admitImageJob, jsonBody, rawImage, imageFields, editBackgroundHandler);
+app.post('/api/resize-image', admitImageJob, jsonBody, rawImage, imageFields, resizeImageHandler);
 
-// For operations that expect image_data (base64) and potentially a file
-app.post('/api/remove-background', express.json(), removeBackgroundHandler);
-app.post('/api/edit-background', upload.single('background_image'), editBackgroundHandler);
-app.post('/api/resize-image', express.json(), resizeImageHandler);
+// Composable transforms: `operations` is an ordered list (JSON array, or its JSON
+// string in multipart/query) compiled into a single sharp pipeline. The routes
+// above are thin wrappers over the same pipeline.
+app.post('/api/transform', admitImageJob, jsonBody, rawImage, imageFields, transformImageHandler);
 
+// Queue, image store, result cache and poster cache statistics (queue wait times,
+// in-flight jobs, cache hits/misses/evictions, background removal latency and
+// throughput per mode, event-loop delay, memory use). Send `?reset=event-loop` to
+// start a new event-loop delay window, e.g. when sampling it during a benchmark;
+// the window is shared with /metrics (see readEventLoopDelay).
+app.get('/api/stats', (req, res) => {
+  res.json({
+    pid: process.pid,
+    imageQueue: imageQueue.stats(),
+    imageStore: imageStore.stats(),
+    resultCache: resultCache.stats(),
+    backgroundRemoval: segmentationStats(),
+    posters: posterCatalogue.stats(),
+    eventLoopDelay: readEventLoopDelay({ reset: req.query.reset === 'event-loop' }),
+    memory: process.memoryUsage(),
+  });
+});
+
+// Prometheus-style metrics (latency histograms, payload sizes, cache hit ratios,
+// sharp stage timings, event-loop delay, heap/RSS).
+app.get('/metrics', metrics.handler());
 
 // Basic route for testing server
 app.get('/', (req, res) => {
   res.send('API server is running!');
 });
 
-// Start the server
-app.listen(PORT, () => {
-  console.log(`API server listening on http://localhost:${PORT}`);
+// Turn body size and parsing errors into JSON responses instead of HTML error pages
+app.use((error, req, res, next) => {
+  if (error instanceof multer.MulterError) {
+    const tooLarge = error.code === 'LIMIT_FILE_SIZE' || error.code === 'LIMIT_FIELD_VALUE';
+    return res.status(tooLarge ? 413 : 400).json({
+      error: error.message
+    });
+  }
+  if (error.type === 'entity.too.large') {
+    return res.status(413).json({
+      error: `Request body is larger than the ${MAX_UPLOAD_BYTES} byte limit.`
+    });
+  }
+  if (error.type === 'entity.parse.failed') {
+    return res.status(400).json({
+      error: 'Request body is not valid JSON.'
+    });
+  }
+  logger.error('Unhandled error', { error, method: req.method, path: req.path });
+  return res.status(500).json({
+    error: 'Internal server error.'
+  });
+});
+
+// Start the server once the segmentation model (if configured) has loaded.
+loadSegmentationModel().then(() => {
+  app.listen(PORT, () => {
+    logger.info('API server listening', { port: Number(PORT) });
+  });
 });
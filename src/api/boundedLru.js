@@ -0,0 +1,79 @@
+/**
+ * Map with least-recently-used eviction, bounded by entry count and total size.
+ *
+ * Shared by the image store and the result cache. Values are sized with `sizeOf`
+ * (the byte length of their `buffer` by default), and `onEvict` is called for
+ * every entry pushed out by the caps - not for explicit deletes.
+ */
+export class BoundedLru {
+  constructor({
+    maxEntries,
+    maxBytes,
+    sizeOf = (value) => value.buffer.length,
+    onEvict = () => {},
+  }) {
+    this.maxEntries = maxEntries;
+    this.maxBytes = maxBytes;
+    this.sizeOf = sizeOf;
+    this.onEvict = onEvict;
+    // Map iteration order is insertion order, so re-inserting on access keeps
+    // the least recently used entry first.
+    this.map = new Map();
+    this.bytes = 0;
+  }
+
+  get size() {
+    return this.map.size;
+  }
+
+  // Returns the value without changing its position.
+  peek(key) {
+    return this.map.get(key);
+  }
+
+  // Returns the value and marks it as the most recently used.
+  get(key) {
+    const value = this.map.get(key);
+    if (value !== undefined) {
+      this.map.delete(key);
+      this.map.set(key, value);
+    }
+    return value;
+  }
+
+  // Stores a value and evicts the oldest entries until within the caps. Values
+  // larger than `maxBytes` on their own are not stored; returns whether it was.
+  set(key, value) {
+    if (this.sizeOf(value) > this.maxBytes) {
+      return false;
+    }
+    this.delete(key);
+    this.map.set(key, value);
+    this.bytes += this.sizeOf(value);
+    this.trim();
+    return true;
+  }
+
+  delete(key) {
+    const value = this.map.get(key);
+    if (value === undefined) {
+      return false;
+    }
+    this.map.delete(key);
+    this.bytes -= this.sizeOf(value);
+    return true;
+  }
+
+  trim() {
+    while (this.map.size > this.maxEntries || this.bytes > this.maxBytes) {
+      const [key, value] = this.map.entries().next().value;
+      this.delete(key);
+      this.onEvict(key, value);
+    }
+  }
+
+  // Entries from least to most recently used. Deleting while iterating is safe.
+  entries() {
+    return this.map.entries();
+  }
+}
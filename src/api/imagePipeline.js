@@ -0,0 +1,339 @@
+import sharp from 'sharp';
+import { REMOVAL_MODES, removeBackground } from './segmentation.js';
+
+// PNG files always start with this 8-byte signature.
+const PNG_SIGNATURE = Buffer.from([0x89, 0x50, 0x4e, 0x47, 0x0d, 0x0a, 0x1a, 0x0a]);
+
+// Output formats supported by the `format` operation, and their content types.
+const OUTPUT_FORMATS = {
+  png: 'image/png',
+  jpeg: 'image/jpeg',
+  webp: 'image/webp',
+  avif: 'image/avif',
+};
+
+const RESIZE_FITS = ['cover', 'contain', 'fill', 'inside', 'outside'];
+
+// Largest output width or height we render. A single oversized resize (or the
+// solid-colour layer built to match it) would hold a queue slot for minutes.
+export const MAX_OUTPUT_DIMENSION = Number(process.env.MAX_OUTPUT_DIMENSION) || 8192;
+
+// Operations that may only appear once in a pipeline.
+const SINGLE_OPERATIONS = ['resize', 'format'];
+
+// Thrown when a client sends an operation list we can't compile.
+export class InvalidOperationError extends Error {}
+
+export const isPng = (buffer) => buffer.length >= PNG_SIGNATURE.length &&
+  buffer.subarray(0, PNG_SIGNATURE.length).equals(PNG_SIGNATURE);
+
+const toPositiveInt = (value) => {
+  const number = parseInt(value, 10);
+  return number > 0 ? number : null;
+};
+
+const parseOperation = (operation, index) => {
+  if (!operation || typeof operation !== 'object') {
+    throw new InvalidOperationError(`Operation at index ${index} must be an object.`);
+  }
+
+  switch (operation.op) {
+    case 'remove-background': {
+      const mode = operation.mode || 'auto';
+      if (!REMOVAL_MODES.includes(mode)) {
+        throw new InvalidOperationError(`Remove-background at index ${index} must use one of the modes: ${REMOVAL_MODES.join(', ')}.`);
+      }
+      // tolerance/feather only apply to the colour-key mode.
+      const result = { op: 'remove-background', mode };
+      const tolerance = toPositiveInt(operation.tolerance);
+      const feather = toPositiveInt(operation.feather);
+      if (tolerance) {
+        result.tolerance = tolerance;
+      }
+      if (feather) {
+        result.feather = feather;
+      }
+      return result;
+    }
+
+    case 'flatten':
+      // Without a background colour sharp flattens onto black, like the original handler.
+      return operation.background
+        ? { op: 'flatten', background: String(operation.background) }
+        : { op: 'flatten' };
+
+    case 'resize': {
+      const width = toPositiveInt(operation.width);
+      const height = toPositiveInt(operation.height);
+      const fit = operation.fit || 'cover';
+      if (!width && !height) {
+        throw new InvalidOperationError(`Resize at index ${index} needs a positive width or height.`);
+      }
+      if (!RESIZE_FITS.includes(fit)) {
+        throw new InvalidOperationError(`Resize at index ${index} has an unknown fit "${fit}".`);
+      }
+      if (width > MAX_OUTPUT_DIMENSION || height > MAX_OUTPUT_DIMENSION) {
+        throw new InvalidOperationError(`Resize at index ${index} is larger than ${MAX_OUTPUT_DIMENSION} pixels.`);
+      }
+      return { op: 'resize', width, height, fit };
+    }
+
+    case 'composite':
+      // The background is a solid colour, a stored image (by handle), or a multipart file field.
+      if (operation.color) {
+        return { op: 'composite', color: String(operation.color) };
+      }
+      if (operation.image_handle) {
+        return { op: 'composite', image_handle: String(operation.image_handle) };
+      }
+      if (operation.image_field) {
+        return { op: 'composite', image_field: String(operation.image_field) };
+      }
+      throw new InvalidOperationError(`Composite at index ${index} needs a color, image_handle or image_field.`);
+
+    case 'format': {
+      const format = operation.format === 'jpg' ? 'jpeg' : operation.format;
+      if (!OUTPUT_FORMATS[format]) {
+        throw new InvalidOperationError(`Format at index ${index} must be one of: ${Object.keys(OUTPUT_FORMATS).join(', ')}.`);
+      }
+      const quality = toPositiveInt(operation.quality);
+      if (quality && quality > 100) {
+        throw new InvalidOperationError(`Format at index ${index} has a quality above 100.`);
+      }
+      return quality ? { op: 'format', format, quality } : { op: 'format', format };
+    }
+
+    default:
+      throw new InvalidOperationError(`Unknown operation "${operation.op}" at index ${index}.`);
+  }
+};
+
+/**
+ * Validates and normalizes an ordered list of transform operations.
+ *
+ * Accepts an array or its JSON string (as sent in multipart fields or query strings).
+ * Supported operations:
+ *   { op: 'remove-background', mode?: 'auto' | 'segment' | 'colorkey', tolerance?, feather? }
+ *   { op: 'flatten', background? }
+ *   { op: 'resize', width?, height?, fit? }
+ *   { op: 'composite', color | image_handle | image_field }
+ *   { op: 'format', format: 'png' | 'jpeg' | 'webp' | 'avif', quality? }
+ *
+ * @param {Array|string|undefined} input - The operations sent by the client.
+ * @returns {Array} The normalized operations.
+ */
+export const parseOperations = (input) => {
+  if (input === undefined || input === null || input === '') {
+    return [];
+  }
+
+  let list = input;
+  if (typeof list === 'string') {
+    try {
+      list = JSON.parse(list);
+    } catch (error) {
+      throw new InvalidOperationError('operations must be a JSON array.');
+    }
+  }
+  if (!Array.isArray(list)) {
+    throw new InvalidOperationError('operations must be an array.');
+  }
+
+  const operations = list.map(parseOperation);
+  for (const op of SINGLE_OPERATIONS) {
+    if (operations.filter((operation) => operation.op === op).length > 1) {
+      throw new InvalidOperationError(`Only one "${op}" operation is allowed.`);
+    }
+  }
+
+  // Background removal works on the original pixels, so nothing may have been
+  // flattened or composited behind the image before it.
+  const removalIndex = operations.findIndex((operation) => operation.op === 'remove-background');
+  if (removalIndex !== -1 && operations.slice(0, removalIndex)
+    .some((operation) => operation.op === 'flatten' || operation.op === 'composite')) {
+    throw new InvalidOperationError('remove-background must come before any flatten or composite operation.');
+  }
+  return operations;
+};
+
+// Content type of the image produced by an operation list (PNG unless a format is given).
+export const outputContentType = (operations) => {
+  const format = operations.find((operation) => operation.op === 'format');
+  return OUTPUT_FORMATS[format ? format.format : 'png'];
+};
+
+// Works out the final image size so composite layers can be built to match it.
+// Returns `exact: true` when the size is exactly what was asked for, and false when
+// it was derived from the aspect ratio (so we pin it with fit: 'fill').
+export const outputSize = ({ width, height }, resize) => {
+  if (!resize) {
+    return { width, height, exact: true };
+  }
+  if (resize.width && resize.height && resize.fit !== 'inside' && resize.fit !== 'outside') {
+    return { width: resize.width, height: resize.height, exact: true };
+  }
+
+  const scales = [
+    resize.width && resize.width / width,
+    resize.height && resize.height / height,
+  ].filter(Boolean);
+  const scale = resize.fit === 'outside' ? Math.max(...scales) : Math.min(...scales);
+  return {
+    width: Math.max(1, Math.round(width * scale)),
+    height: Math.max(1, Math.round(height * scale)),
+    exact: false,
+  };
+};
+
+// Builds a `dest-over` composite layer (placed behind the image) at the output size.
+const compositeLayer = async (operation, width, height) => {
+  if (operation.color) {
+    return {
+      input: {
+        create: {
+          width,
+          height,
+          channels: 4, // RGBA for transparency
+          background: operation.color,
+        },
+      },
+      blend: 'dest-over',
+    };
+  }
+
+  // Background images are scaled to cover the output and handed over as raw pixels,
+  // so they are never encoded on the way into the composite.
+  const { data, info } = await sharp(operation.input)
+    .resize(width, height, { fit: 'cover' })
+    .ensureAlpha()
+    .raw()
+    .toBuffer({ resolveWithObject: true });
+
+  return {
+    input: data,
+    raw: { width: info.width, height: info.height, channels: info.channels },
+    blend: 'dest-over',
+  };
+};
+
+/**
+ * Maps an operation list onto sharp's fixed stage order: an optional flatten of
+ * the input, one resize, the composite layers placed behind the image, and the
+ * output format. A flatten listed after a composite becomes one more solid-colour
+ * layer, which is what flattening the composited result would produce.
+ *
+ * @param {Array} operations - Operations returned by `parseOperations`.
+ * @returns {{ removal, resize, format, flatten, layers: Array }}
+ */
+export const planPipeline = (operations) => {
+  let flatten = null;
+  const layers = [];
+  for (const operation of operations) {
+    if (operation.op === 'flatten' && layers.length === 0) {
+      flatten = operation;
+    } else if (operation.op === 'flatten') {
+      layers.push({ color: operation.background || '#000000' });
+    } else if (operation.op === 'composite') {
+      layers.push(operation);
+    }
+  }
+
+  return {
+    removal: operations.find((operation) => operation.op === 'remove-background') || null,
+    resize: operations.find((operation) => operation.op === 'resize') || null,
+    format: operations.find((operation) => operation.op === 'format') || { format: 'png' },
+    flatten,
+    layers,
+  };
+};
+
+// Runs `fn` and records how long it took, in milliseconds, under `timings[stage]`.
+const timeStage = async (timings, stage, fn) => {
+  const start = process.hrtime.bigint();
+  try {
+    return await fn();
+  } finally {
+    timings[stage] = Number(process.hrtime.bigint() - start) / 1e6;
+  }
+};
+
+/**
+ * Compiles an operation list into a single sharp pipeline and runs it, so the
+ * input is decoded once and the output encoded once no matter how many
+ * operations there are.
+ *
+ * Operations are mapped onto sharp's fixed stage order by `planPipeline`.
+ * Background removal needs the pixels themselves, so when it is requested the
+ * input is decoded to raw RGBA first, its alpha channel is replaced, and the
+ * pipeline continues from those raw pixels - still a single decode and a single
+ * encode. Composite operations must already carry their background bytes in
+ * `input` (see the transform handler).
+ *
+ * @param {Buffer} inputBuffer - The encoded input image.
+ * @param {Array} operations - Operations returned by `parseOperations`.
+ * @returns {Promise<{buffer: Buffer, contentType: string, timings: object}>}
+ */
+export const runPipeline = async (inputBuffer, operations) => {
+  const timings = {};
+  const { removal, resize, format, flatten, layers } = planPipeline(operations);
+  const contentType = OUTPUT_FORMATS[format.format];
+
+  // Nothing to do: an image that's already a PNG is returned as-is.
+  if (!removal && !resize && !flatten && layers.length === 0 && format.format === 'png' &&
+      !format.quality && isPng(inputBuffer)) {
+    return { buffer: inputBuffer, contentType, timings };
+  }
+
+  let openImage = () => sharp(inputBuffer);
+  if (removal) {
+    const { data, info } = await timeStage(timings, 'decode', () => sharp(inputBuffer)
+      .ensureAlpha()
+      .raw()
+      .toBuffer({ resolveWithObject: true }));
+    await timeStage(timings, 'mask', () => removeBackground(data, info.width, info.height, removal));
+    const raw = { width: info.width, height: info.height, channels: 4 };
+    openImage = () => sharp(data, { raw });
+  }
+
+  let size = null;
+  if (layers.length > 0) {
+    // Only reads the image header; the pixels are decoded once, in the pipeline below.
+    const metadata = await timeStage(timings, 'metadata', () => openImage().metadata());
+    if (!metadata.width || !metadata.height) {
+      throw new Error('Could not determine image dimensions for composite.');
+    }
+    size = outputSize(metadata, resize);
+    // A side derived from the aspect ratio can still exceed the limit (e.g. 'outside').
+    if (size.width > MAX_OUTPUT_DIMENSION || size.height > MAX_OUTPUT_DIMENSION) {
+      throw new InvalidOperationError(`The output would be larger than ${MAX_OUTPUT_DIMENSION} pixels.`);
+    }
+  }
+
+  const compositeLayers = layers.length > 0
+    ? await timeStage(timings, 'prepare', () => Promise.all(
+      layers.map((layer) => compositeLayer(layer, size.width, size.height))
+    ))
+    : [];
+
+  const buffer = await timeStage(timings, 'pipeline', () => {
+    let image = openImage();
+
+    if (flatten) {
+      image = image.flatten(flatten.background ? { background: flatten.background } : undefined);
+    }
+    if (resize && size && !size.exact) {
+      image = image.resize(size.width, size.height, { fit: 'fill' });
+    } else if (resize) {
+      image = image.resize(resize.width, resize.height, { fit: resize.fit });
+    }
+    if (compositeLayers.length > 0) {
+      image = image.composite(compositeLayers);
+    }
+
+    return image
+      .toFormat(format.format, format.quality ? { quality: format.quality } : {})
+      .toBuffer();
+  });
+
+  return { buffer, contentType, timings };
+};
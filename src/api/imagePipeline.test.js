@@ -0,0 +1,112 @@
+/**
+ * @jest-environment node
+ */
+import {
+  InvalidOperationError,
+  MAX_OUTPUT_DIMENSION,
+  outputContentType,
+  outputSize,
+  parseOperations,
+  planPipeline,
+} from './imagePipeline';
+
+const rejects = (input, message) => {
+  let error;
+  try {
+    parseOperations(input);
+  } catch (caught) {
+    error = caught;
+  }
+  expect(error instanceof InvalidOperationError).toBe(true);
+  expect(error.message).toBe(message);
+};
+
+test('operations are accepted as an array or its JSON string', () => {
+  const operations = [{ op: 'resize', width: '800' }];
+
+  expect(parseOperations(operations)).toEqual([{ op: 'resize', width: 800, height: null, fit: 'cover' }]);
+  expect(parseOperations([{ op: 'resize', width: MAX_OUTPUT_DIMENSION }])[0].width).toBe(MAX_OUTPUT_DIMENSION);
+  expect(parseOperations(JSON.stringify(operations))).toEqual(parseOperations(operations));
+  expect(parseOperations(undefined)).toEqual([]);
+  expect(parseOperations('')).toEqual([]);
+});
+
+test('malformed operation lists are rejected with a message for the client', () => {
+  rejects('{not json', 'operations must be a JSON array.');
+  rejects({ op: 'resize' }, 'operations must be an array.');
+  rejects(['resize'], 'Operation at index 0 must be an object.');
+  rejects([{ op: 'rotate' }], 'Unknown operation "rotate" at index 0.');
+  rejects([{ op: 'resize' }], 'Resize at index 0 needs a positive width or height.');
+  rejects([{ op: 'resize', width: 10, fit: 'stretch' }], 'Resize at index 0 has an unknown fit "stretch".');
+  rejects([{ op: 'resize', width: 100000, height: 100000 }],
+    `Resize at index 0 is larger than ${MAX_OUTPUT_DIMENSION} pixels.`);
+  rejects([{ op: 'resize', height: MAX_OUTPUT_DIMENSION + 1 }],
+    `Resize at index 0 is larger than ${MAX_OUTPUT_DIMENSION} pixels.`);
+  rejects([{ op: 'composite' }], 'Composite at index 0 needs a color, image_handle or image_field.');
+  rejects([{ op: 'remove-background', mode: 'magic' }],
+    'Remove-background at index 0 must use one of the modes: auto, segment, colorkey.');
+});
+
+test('formats are normalized and quality is bounded', () => {
+  expect(parseOperations([{ op: 'format', format: 'jpg', quality: '80' }]))
+    .toEqual([{ op: 'format', format: 'jpeg', quality: 80 }]);
+  expect(parseOperations([{ op: 'format', format: 'webp', quality: 0 }])).toEqual([{ op: 'format', format: 'webp' }]);
+  rejects([{ op: 'format', format: 'webp', quality: 101 }], 'Format at index 0 has a quality above 100.');
+  rejects([{ op: 'format', format: 'gif' }], 'Format at index 0 must be one of: png, jpeg, webp, avif.');
+
+  expect(outputContentType(parseOperations([{ op: 'format', format: 'jpg' }]))).toBe('image/jpeg');
+  expect(outputContentType([])).toBe('image/png');
+});
+
+test('resize and format may only appear once', () => {
+  rejects([{ op: 'resize', width: 10 }, { op: 'resize', width: 20 }], 'Only one "resize" operation is allowed.');
+  rejects([{ op: 'format', format: 'png' }, { op: 'format', format: 'webp' }], 'Only one "format" operation is allowed.');
+});
+
+test('background removal must come before any flatten or composite', () => {
+  rejects([{ op: 'flatten' }, { op: 'remove-background' }],
+    'remove-background must come before any flatten or composite operation.');
+  rejects([{ op: 'composite', color: '#fff' }, { op: 'remove-background' }],
+    'remove-background must come before any flatten or composite operation.');
+
+  expect(parseOperations([
+    { op: 'resize', width: 100 },
+    { op: 'remove-background', mode: 'colorkey', tolerance: '30', feather: 'x' },
+    { op: 'composite', color: '#ffffff' },
+  ])[1]).toEqual({ op: 'remove-background', mode: 'colorkey', tolerance: 30 });
+});
+
+test('a flatten before any composite flattens the input; after one it becomes a layer', () => {
+  const plan = planPipeline(parseOperations([
+    { op: 'flatten', background: '#ff0000' },
+    { op: 'composite', color: '#00ff00' },
+    { op: 'flatten' },
+    { op: 'flatten', background: '#0000ff' },
+  ]));
+
+  expect(plan.flatten).toEqual({ op: 'flatten', background: '#ff0000' });
+  expect(plan.layers).toEqual([
+    { op: 'composite', color: '#00ff00' },
+    { color: '#000000' },
+    { color: '#0000ff' },
+  ]);
+  expect(plan.format).toEqual({ format: 'png' });
+  expect(plan.resize).toBe(null);
+  expect(plan.removal).toBe(null);
+});
+
+test('output sizes follow each resize fit', () => {
+  const input = { width: 4000, height: 3000 };
+  const resize = (fit, width = 800, height = 800) => outputSize(input, { op: 'resize', width, height, fit });
+
+  expect(outputSize(input, null)).toEqual({ width: 4000, height: 3000, exact: true });
+  expect(resize('cover')).toEqual({ width: 800, height: 800, exact: true });
+  expect(resize('contain')).toEqual({ width: 800, height: 800, exact: true });
+  expect(resize('fill')).toEqual({ width: 800, height: 800, exact: true });
+  expect(resize('inside')).toEqual({ width: 800, height: 600, exact: false });
+  expect(resize('outside')).toEqual({ width: 1067, height: 800, exact: false });
+  expect(resize('cover', 800, null)).toEqual({ width: 800, height: 600, exact: false });
+  expect(resize('cover', null, 300)).toEqual({ width: 400, height: 300, exact: false });
+  expect(outputSize({ width: 1, height: 4000 }, { op: 'resize', width: null, height: 100, fit: 'inside' }))
+    .toEqual({ width: 1, height: 100, exact: false });
+});
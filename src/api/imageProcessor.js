@@ -1,4 +1,18 @@
-import sharp from 'sharp';
+import { imageStore } from './imageStore.js';
+import { InvalidOperationError, outputContentType, parseOperations, runPipeline } from './imagePipeline.js';
+import { imageQueue, QueueSaturatedError } from './jobQueue.js';
+import { ResultCache, resultCache, sha256 } from './resultCache.js';
+import { isSegmentationAvailable, resolveRemovalMode } from './segmentation.js';
+import { logger } from './logger.js';
+import { metrics } from './metrics.js';
+
+// Time spent in each pipeline stage (decode, mask, metadata, prepare, pipeline)
+// and waiting in the job queue, for results that were actually computed.
+const stageDuration = metrics.histogram('image_pipeline_stage_duration_seconds',
+  'Time spent in each image pipeline stage.', { labelNames: ['stage'] });
+// Where transform results came from: a handle's derived image, the result cache, or sharp.
+const transformResults = metrics.counter('image_transform_results_total',
+  'Image transform results by source.', { labelNames: ['source'] });
 
 // Helper function to decode Base64 image data
 const decodeBase64Image = (dataString) => {
@@ -7,222 +21,416 @@ const decodeBase64Image = (dataString) => {
     const base64Data = dataString.replace(/^data:image\/(png|jpeg|jpg|gif);base64,/, '');
     return Buffer.from(base64Data, 'base64');
   } catch (error) {
-    console.error('Error decoding Base64 image data:', error);
+    logger.error('Error decoding Base64 image data', { error });
     return null;
   }
 };
 
-// Helper function to encode image buffer to Base64
-const encodeImageToBase64 = async (imageBuffer) => {
-  try {
-    const outputBuffer = await sharp(imageBuffer).toFormat('png').toBuffer();
-    return outputBuffer.toString('base64');
-  } catch (error) {
-    console.error('Error encoding image to Base64:', error);
-    throw new Error('Failed to encode image to Base64.');
+// Helper function to get an uploaded file from multer, whether the route used
+// `upload.single()` (req.file) or `upload.fields()` (req.files).
+const getUploadedFile = (req, fieldName) => {
+  if (req.file && req.file.fieldname === fieldName) {
+    return req.file;
+  }
+  if (req.files && req.files[fieldName] && req.files[fieldName].length > 0) {
+    return req.files[fieldName][0];
   }
+  return null;
 };
 
-
-// Handler for initial image upload
-export const uploadImageHandler = async (req, res) => {
-  if (!req.file) {
-    return res.status(400).json({
-      error: 'No image file uploaded.'
-    });
+// Helper function to read the input image from a request. Supports, in order:
+// - a multipart file in the `image` field,
+// - a raw `application/octet-stream` / `image/*` body (parsed by express.raw),
+// - the legacy base64 `image_data` field in a JSON or multipart body.
+const readImageInput = (req) => {
+  const file = getUploadedFile(req, 'image');
+  if (file) {
+    return file.buffer;
+  }
+  if (Buffer.isBuffer(req.body) && req.body.length > 0) {
+    return req.body;
   }
+  if (req.body && typeof req.body.image_data === 'string' && req.body.image_data) {
+    return decodeBase64Image(req.body.image_data);
+  }
+  return null;
+};
 
-  try {
-    const imageDataBuffer = req.file.buffer;
-    const base64Image = await encodeImageToBase64(imageDataBuffer);
+// Helper function to read operation parameters. With a raw binary body there is
+// nowhere else to put them, so they come from the query string.
+const readParams = (req) => {
+  if (Buffer.isBuffer(req.body)) {
+    return { ...req.query };
+  }
+  return { ...req.query, ...(req.body || {}) };
+};
 
-    return res.status(200).json({
-      message: 'Image uploaded and processed successfully!',
-      image_data: base64Image, // Send back Base64 string
-    });
-  } catch (error) {
-    console.error('Error during image upload and initial processing:', error);
-    return res.status(500).json({
-      error: 'Failed to process uploaded image.'
-    });
+// Helper function to resolve the image a request operates on: either a stored
+// image referenced by `image_handle`, or image bytes sent with the request.
+const resolveImageInput = (req) => {
+  const { image_handle } = readParams(req);
+  if (image_handle) {
+    const entry = imageStore.get(image_handle);
+    if (!entry) {
+      return {
+        status: 404,
+        error: 'Image handle not found or expired. Please upload the image again.'
+      };
+    }
+    return { buffer: entry.buffer, hash: entry.hash, handle: image_handle };
   }
+  return { buffer: readImageInput(req), handle: null };
 };
 
-// Handler for removing background
-export const removeBackgroundHandler = async (req, res) => {
-  const {
-    image_data
-  } = req.body;
+// Binary clients get raw bytes back. Raw-body requests default to binary, while
+// JSON/multipart requests keep the JSON response unless the client explicitly
+// asks for an image via the Accept header.
+const wantsBinaryResponse = (req, contentType) => {
+  const offered = Buffer.isBuffer(req.body) ? [contentType, 'json'] : ['json', contentType];
+  return req.accepts(offered) === contentType;
+};
 
-  if (!image_data) {
-    return res.status(400).json({
-      error: 'No image data provided for background removal.'
-    });
+const previewUrl = (handle) => `/api/images/${handle}`;
+
+// Formats per-stage timings (in milliseconds) as a Server-Timing header value.
+const serverTiming = ({ timings, cached }) => {
+  const stages = Object.entries(timings).map(([stage, ms]) => `${stage};dur=${ms.toFixed(2)}`);
+  if (cached) {
+    stages.unshift('cache;desc="hit"');
   }
+  return stages.join(', ');
+};
 
-  try {
-    const inputBuffer = decodeBase64Image(image_data);
-    if (!inputBuffer) {
-      return res.status(400).json({
-        error: 'Invalid image data provided.'
-      });
-    }
+// Helper function to send a transform result in the format the client asked for.
+// JSON responses include the Base64 `image_data` unless `include_data=false` is sent,
+// so handle-based clients can skip downloading the image and use the preview URL.
+const sendImage = (req, res, result, message) => {
+  const { handle, buffer, contentType, timings, cached, etag } = result;
+  res.set('Server-Timing', serverTiming(result));
 
-    // Sharp can remove backgrounds if the image has an alpha channel,
-    // or by converting to a format that supports transparency (like PNG).
-    // For true "background removal" (segmentation), you'd need a more advanced
-    // library or API (like remove.bg, or an ML model).
-    // Here, we convert to PNG with an alpha channel, assuming the original
-    // might have a solid background that can be "made transparent" if it's white.
-    // This is a basic approach.
-    const outputBuffer = await sharp(inputBuffer)
-      .flatten() // Remove alpha channel if present (makes it opaque)
-      .toFormat('png') // Convert to PNG to ensure alpha channel support
-      .toBuffer();
-
-    const base64Image = await encodeImageToBase64(outputBuffer);
-
-    return res.status(200).json({
-      message: 'Background removed (converted to transparent PNG).',
-      image_data: base64Image,
-    });
-  } catch (error) {
-    console.error('Error during background removal:', error);
-    return res.status(500).json({
-      error: 'Failed to remove background.'
-    });
+  if (wantsBinaryResponse(req, contentType)) {
+    // The same input and operations always give the same bytes, so the ETag is strong.
+    return res.status(200)
+      .type(contentType)
+      .set({
+        ETag: etag,
+        'Content-Length': String(buffer.length),
+        'X-Image-Handle': handle,
+        'X-Preview-Url': previewUrl(handle),
+      })
+      .send(buffer);
   }
+
+  const response = {
+    message,
+    image_handle: handle,
+    preview_url: previewUrl(handle),
+    content_type: contentType,
+    cached,
+    timings,
+  };
+  if (String(readParams(req).include_data) !== 'false') {
+    response.image_data = buffer.toString('base64'); // Send back Base64 string
+  }
+  return res.status(200).json(response);
 };
 
-// Handler for editing background (solid color or image)
-export const editBackgroundHandler = async (req, res) => {
-  const {
-    image_data,
-    color
-  } = req.body; // color for solid background
-  const backgroundImageFile = req.file; // The uploaded background image file from multer
-
-  if (!image_data) {
+// True when the client's If-None-Match already names this ETag.
+const matchesEtag = (req, etag) => {
+  const header = req.get('If-None-Match');
+  return Boolean(header) && header.split(',').some((tag) => tag.trim() === etag || tag.trim() === '*');
+};
+
+// Shared flow behind every image route: resolve the input image and any composite
+// backgrounds, then reuse an earlier result if there is one - first for this exact
+// handle, then by content (input hash + operations) in the result cache - and
+// otherwise run the operations as one sharp pipeline. The output is stored under
+// a new handle and sent back.
+const runTransform = async (req, res, {
+  operations,
+  missingMessage,
+  successMessage,
+  errorMessage,
+}) => {
+  const start = process.hrtime.bigint();
+
+  const input = resolveImageInput(req);
+  if (input.error) {
+    return res.status(input.status).json({
+      error: input.error
+    });
+  }
+  if (!input.buffer) {
     return res.status(400).json({
-      error: 'No image data provided to edit background.'
+      error: missingMessage
     });
   }
 
-  try {
-    const inputBuffer = decodeBase64Image(image_data);
-    if (!inputBuffer) {
-      return res.status(400).json({
-        error: 'Invalid image data provided.'
-      });
+  // Composite backgrounds are resolved to their bytes for the pipeline and to their
+  // content hash for the cache key, so results stay cacheable however they were sent.
+  const resolvedOperations = [];
+  const keyOperations = [];
+  for (const operation of operations) {
+    if (operation.op === 'remove-background') {
+      // `auto` is resolved here so the cache key names the mode that actually ran.
+      const mode = resolveRemovalMode(operation.mode);
+      if (mode === 'segment' && !isSegmentationAvailable()) {
+        return res.status(400).json({
+          error: 'Segmentation is not available on this server. Use mode "colorkey" or "auto".'
+        });
+      }
+      resolvedOperations.push({ ...operation, mode });
+      keyOperations.push({ ...operation, mode });
+      continue;
+    }
+    if (operation.op !== 'composite' || operation.color) {
+      resolvedOperations.push(operation);
+      keyOperations.push(operation);
+      continue;
     }
 
-    let processedImage = sharp(inputBuffer);
-
-    if (backgroundImageFile) {
-      // Apply image background
-      const backgroundBuffer = backgroundImageFile.buffer;
-      processedImage = await sharp(inputBuffer)
-        .composite([{
-          input: backgroundBuffer,
-          blend: 'dest-over'
-        }]) // Place original image over background
-        .toBuffer();
-    } else if (color) {
-      // Apply solid color background
-      const metadata = await sharp(inputBuffer).metadata();
-      const {
-        width,
-        height
-      } = metadata;
-
-      if (!width || !height) {
-        throw new Error("Could not determine image dimensions for solid background.");
+    let background;
+    if (operation.image_handle) {
+      background = imageStore.get(operation.image_handle);
+      if (!background) {
+        return res.status(404).json({
+          error: 'Background image handle not found or expired.'
+        });
       }
+    } else {
+      const file = getUploadedFile(req, operation.image_field);
+      if (!file) {
+        return res.status(400).json({
+          error: `No background image uploaded in the "${operation.image_field}" field.`
+        });
+      }
+      background = { buffer: file.buffer, hash: sha256(file.buffer) };
+    }
+    resolvedOperations.push({ op: 'composite', input: background.buffer });
+    keyOperations.push({ op: 'composite', image_sha256: background.hash });
+  }
+
+  const inputHash = input.hash || sha256(input.buffer);
+  const cacheKey = ResultCache.key(inputHash, keyOperations);
+  const etag = `"${cacheKey}"`;
+
+  // The result is fully determined by the key, so a binary client that already
+  // has it can be answered without touching the image at all.
+  if (wantsBinaryResponse(req, outputContentType(operations)) && matchesEtag(req, etag)) {
+    return res.status(304).set('ETag', etag).end();
+  }
 
-      // Create a solid color background image
-      const solidColorBuffer = await sharp({
-          create: {
-            width: width,
-            height: height,
-            channels: 4, // RGBA for transparency
-            background: color,
-          },
-        })
-        .png() // Ensure it's a PNG for transparency
-        .toBuffer();
-
-      // Composite the original image over the solid color background
-      processedImage = await sharp(inputBuffer)
-        .composite([{
-          input: solidColorBuffer,
-          blend: 'dest-over'
-        }]) // Place original image over solid background
-        .toBuffer();
+  const params = { operations: JSON.stringify(keyOperations) };
 
+  try {
+    let result;
+    const derivedHandle = input.handle ? imageStore.getDerived(input.handle, 'transform', params) : null;
+
+    if (derivedHandle) {
+      const entry = imageStore.get(derivedHandle);
+      result = {
+        handle: derivedHandle,
+        buffer: entry.buffer,
+        contentType: entry.contentType,
+        timings: {},
+        cached: true,
+      };
+      transformResults.inc({ source: 'derived' });
     } else {
+      let output = await resultCache.get(cacheKey);
+      const cached = Boolean(output);
+
+      if (cached) {
+        output = { ...output, timings: {} };
+        transformResults.inc({ source: 'result-cache' });
+      } else {
+        // sharp work goes through the shared queue so bursts can't run unbounded jobs at once.
+        const queuedAt = process.hrtime.bigint();
+        let startedAt;
+        output = await imageQueue.run(() => {
+          startedAt = process.hrtime.bigint();
+          return runPipeline(input.buffer, resolvedOperations);
+        });
+        output.timings.queue = Number(startedAt - queuedAt) / 1e6;
+        resultCache.set(cacheKey, { buffer: output.buffer, contentType: output.contentType });
+        transformResults.inc({ source: 'pipeline' });
+        for (const [stage, ms] of Object.entries(output.timings)) {
+          stageDuration.observe({ stage }, ms / 1000);
+        }
+      }
+
+      // Stored images are keyed by their own hash, which we already know when the
+      // pipeline passed the input through unchanged.
+      const handle = imageStore.put(
+        output.buffer,
+        output.contentType,
+        output.buffer === input.buffer ? inputHash : null
+      );
+      if (input.handle) {
+        imageStore.setDerived(input.handle, 'transform', params, handle);
+      }
+      result = { ...output, handle, cached };
+    }
+
+    result.etag = etag;
+    result.timings.total = Number(process.hrtime.bigint() - start) / 1e6;
+    return sendImage(req, res, result, successMessage);
+  } catch (error) {
+    if (error instanceof InvalidOperationError) {
       return res.status(400).json({
-        error: 'No background color or image provided.'
+        error: error.message
       });
     }
+    if (error instanceof QueueSaturatedError) {
+      return res.status(503)
+        .set('Retry-After', String(error.retryAfter))
+        .json({
+          error: 'The image server is busy. Please try again shortly.'
+        });
+    }
+    logger.error('Error during image transform', { error });
+    return res.status(500).json({
+      error: errorMessage
+    });
+  }
+};
 
-    const base64Image = await encodeImageToBase64(processedImage);
 
-    return res.status(200).json({
-      message: 'Background edited successfully!',
-      image_data: base64Image,
-    });
+// Handler for composable transforms: runs an ordered list of operations
+// (remove-background, flatten, resize, composite, format) with a single decode
+// and a single encode.
+export const transformImageHandler = (req, res) => {
+  let operations;
+  try {
+    operations = parseOperations(readParams(req).operations);
   } catch (error) {
-    console.error('Error during background editing:', error);
-    return res.status(500).json({
-      error: 'Failed to edit background.'
-    });
+    if (error instanceof InvalidOperationError) {
+      return res.status(400).json({
+        error: error.message
+      });
+    }
+    throw error;
   }
+
+  return runTransform(req, res, {
+    operations,
+    missingMessage: 'No image data provided to transform.',
+    successMessage: 'Image transformed successfully!',
+    errorMessage: 'Failed to transform image.',
+  });
 };
 
-// Handler for resizing image
-export const resizeImageHandler = async (req, res) => {
-  const {
-    image_data,
-    width,
-    height
-  } = req.body;
-
-  if (!image_data) {
-    return res.status(400).json({
-      error: 'No image data provided for resizing.'
+// Handler for initial image upload
+export const uploadImageHandler = (req, res) => runTransform(req, res, {
+  // No operations: PNG uploads are stored as-is, anything else is encoded to PNG once.
+  operations: [],
+  missingMessage: 'No image file uploaded.',
+  successMessage: 'Image uploaded and processed successfully!',
+  errorMessage: 'Failed to process uploaded image.',
+});
+
+// Handler for serving a stored image by handle (used for previews and downloads)
+export const getImageHandler = (req, res) => {
+  const entry = imageStore.get(req.params.handle);
+  if (!entry) {
+    return res.status(404).json({
+      error: 'Image handle not found or expired.'
     });
   }
 
+  // A handle always refers to the same bytes, so the browser may cache it until it expires.
+  const maxAge = Math.max(0, Math.floor((entry.expiresAt - Date.now()) / 1000));
+  res.set({
+    ETag: `"${entry.hash}"`,
+    'Cache-Control': `private, max-age=${maxAge}, immutable`,
+  });
+  if (req.fresh) {
+    return res.status(304).end();
+  }
+  return res.status(200)
+    .type(entry.contentType)
+    .set('Content-Length', String(entry.buffer.length))
+    .send(entry.buffer);
+};
+
+// Handler for removing background
+// `mode` picks how: "segment" runs the segmentation model (when one is loaded),
+// "colorkey" makes a uniform background colour transparent, and "auto" (the
+// default) uses the model if available and the colour key otherwise.
+export const removeBackgroundHandler = (req, res) => {
+  const { mode, tolerance, feather } = readParams(req);
+
+  let operations;
   try {
-    const inputBuffer = decodeBase64Image(image_data);
-    if (!inputBuffer) {
+    operations = parseOperations([{ op: 'remove-background', mode: mode || 'auto', tolerance, feather }]);
+  } catch (error) {
+    if (error instanceof InvalidOperationError) {
       return res.status(400).json({
-        error: 'Invalid image data provided.'
+        error: error.message
       });
     }
+    throw error;
+  }
 
-    let sharpImage = sharp(inputBuffer);
-
-    // Only resize if width or height are provided and valid numbers
-    if ((width && !isNaN(width) && width > 0) || (height && !isNaN(height) && height > 0)) {
-      sharpImage = sharpImage.resize(width || null, height || null);
-    } else {
-      // If no valid width/height, we are essentially sending back the original
-      // but still processing it through sharp to ensure format consistency
-      // (e.g., to PNG if not already).
-    }
+  return runTransform(req, res, {
+    operations,
+    missingMessage: 'No image data provided for background removal.',
+    successMessage: 'Background removed (transparent PNG).',
+    errorMessage: 'Failed to remove background.',
+  });
+};
 
-    const outputBuffer = await sharpImage.toFormat('png').toBuffer();
-    const base64Image = await encodeImageToBase64(outputBuffer);
+// Handler for editing background (solid color or image)
+export const editBackgroundHandler = (req, res) => {
+  const { color } = readParams(req); // color for solid background
+  const backgroundImageFile = getUploadedFile(req, 'background_image'); // The uploaded background image file from multer
 
-    return res.status(200).json({
-      message: 'Image resized successfully!',
-      image_data: base64Image,
+  let operation;
+  if (backgroundImageFile) {
+    // Apply image background
+    operation = { op: 'composite', image_field: 'background_image' };
+  } else if (color) {
+    // Apply solid color background
+    operation = { op: 'composite', color: String(color) };
+  } else {
+    return res.status(400).json({
+      error: 'No background color or image provided.'
     });
+  }
+
+  return runTransform(req, res, {
+    operations: [operation], // Place original image over background
+    missingMessage: 'No image data provided to edit background.',
+    successMessage: 'Background edited successfully!',
+    errorMessage: 'Failed to edit background.',
+  });
+};
+
+// Handler for resizing image
+export const resizeImageHandler = (req, res) => {
+  const params = readParams(req);
+  // Multipart and query-string values arrive as strings.
+  const width = parseInt(params.width, 10) > 0 ? parseInt(params.width, 10) : null;
+  const height = parseInt(params.height, 10) > 0 ? parseInt(params.height, 10) : null;
+
+  // Only resize if width or height are provided and valid numbers; otherwise
+  // the image is just normalized to PNG.
+  let operations;
+  try {
+    operations = parseOperations((width || height) ? [{ op: 'resize', width, height, fit: 'cover' }] : []);
   } catch (error) {
-    console.error('Error during image resizing:', error);
-    return res.status(500).json({
-      error: 'Failed to resize image.'
-    });
+    if (error instanceof InvalidOperationError) {
+      return res.status(400).json({
+        error: error.message
+      });
+    }
+    throw error;
   }
-};
\ No newline at end of file
+
+  return runTransform(req, res, {
+    operations,
+    missingMessage: 'No image data provided for resizing.',
+    successMessage: 'Image resized successfully!',
+    errorMessage: 'Failed to resize image.',
+  });
+};
@@ -0,0 +1,142 @@
+import crypto from 'crypto';
+import { BoundedLru } from './boundedLru.js';
+
+// Capacity and idle lifetime of the shared store (IMAGE_STORE_* variables).
+const DEFAULT_MAX_ENTRIES = Number(process.env.IMAGE_STORE_MAX_ENTRIES) || 200;
+const DEFAULT_MAX_BYTES = Number(process.env.IMAGE_STORE_MAX_BYTES) || 256 * 1024 * 1024;
+const DEFAULT_TTL_MS = Number(process.env.IMAGE_STORE_TTL_MS) || 15 * 60 * 1000;
+
+// Builds a stable cache key for an operation, independent of parameter order.
+const operationKey = (handle, operation, params = {}) => {
+  const normalized = Object.keys(params)
+    .filter((key) => params[key] !== undefined && params[key] !== null && params[key] !== '')
+    .sort()
+    .map((key) => [key, String(params[key])]);
+  return `${handle}:${operation}:${JSON.stringify(normalized)}`;
+};
+
+/**
+ * Bounded in-memory store for images being edited, addressed by short-lived handles.
+ *
+ * Entries are evicted least-recently-used first whenever the entry count or the
+ * total byte size goes over its cap, and expire after `ttlMs` without being read.
+ * The store also remembers which handle an operation produced from another handle,
+ * so repeating an operation (e.g. after an undo) is served from memory.
+ */
+export class ImageStore {
+  constructor({
+    maxEntries = DEFAULT_MAX_ENTRIES,
+    maxBytes = DEFAULT_MAX_BYTES,
+    ttlMs = DEFAULT_TTL_MS,
+  } = {}) {
+    this.maxEntries = maxEntries;
+    this.maxBytes = maxBytes;
+    this.ttlMs = ttlMs;
+    this.entries = new BoundedLru({
+      maxEntries,
+      maxBytes,
+      onEvict: () => {
+        this.counters.evictions++;
+      },
+    });
+    this.derived = new Map();
+    this.counters = { hits: 0, misses: 0, derivedHits: 0, evictions: 0, expirations: 0 };
+  }
+
+  // Stores an image buffer and returns its new handle. `hash` is the SHA-256 of the
+  // bytes (hex); it is computed here when the caller doesn't already know it.
+  put(buffer, contentType = 'image/png', hash = null) {
+    if (buffer.length > this.maxBytes) {
+      throw new Error('Image is larger than the image store capacity.');
+    }
+
+    this.evict();
+    const handle = crypto.randomBytes(12).toString('base64url');
+    this.entries.set(handle, {
+      buffer,
+      contentType,
+      hash: hash || crypto.createHash('sha256').update(buffer).digest('hex'),
+      expiresAt: Date.now() + this.ttlMs,
+    });
+    return handle;
+  }
+
+  // Returns the entry for a handle, or null if it is unknown or expired.
+  get(handle) {
+    const entry = this.entries.peek(handle);
+    if (!entry) {
+      this.counters.misses++;
+      return null;
+    }
+    if (entry.expiresAt <= Date.now()) {
+      this.delete(handle);
+      this.counters.expirations++;
+      this.counters.misses++;
+      return null;
+    }
+
+    // Refresh both the LRU position and the TTL.
+    this.entries.get(handle);
+    entry.expiresAt = Date.now() + this.ttlMs;
+    this.counters.hits++;
+    return entry;
+  }
+
+  // Returns the handle previously produced by running `operation` with `params`
+  // on `handle`, or null if it isn't cached (or has since been evicted).
+  getDerived(handle, operation, params) {
+    const key = operationKey(handle, operation, params);
+    const derivedHandle = this.derived.get(key);
+    if (!derivedHandle) {
+      return null;
+    }
+    if (!this.get(derivedHandle)) {
+      this.derived.delete(key);
+      return null;
+    }
+    this.counters.derivedHits++;
+    return derivedHandle;
+  }
+
+  setDerived(handle, operation, params, derivedHandle) {
+    const key = operationKey(handle, operation, params);
+    this.derived.delete(key);
+    this.derived.set(key, derivedHandle);
+    // The mapping is tiny, but keep it bounded in case handles churn quickly.
+    while (this.derived.size > this.maxEntries * 4) {
+      this.derived.delete(this.derived.keys().next().value);
+    }
+  }
+
+  delete(handle) {
+    this.entries.delete(handle);
+  }
+
+  // Drops expired entries. The entry and byte caps are enforced on every put.
+  evict() {
+    const now = Date.now();
+    for (const [handle, entry] of this.entries.entries()) {
+      if (entry.expiresAt <= now) {
+        this.delete(handle);
+        this.counters.expirations++;
+      }
+    }
+  }
+
+  stats() {
+    return {
+      entries: this.entries.size,
+      bytes: this.entries.bytes,
+      maxEntries: this.maxEntries,
+      maxBytes: this.maxBytes,
+      ttlMs: this.ttlMs,
+      ...this.counters,
+    };
+  }
+}
+
+// Shared store used by the image processing handlers.
+export const imageStore = new ImageStore();
+
+// Periodically drop expired entries so idle images don't hold memory until the next upload.
+setInterval(() => imageStore.evict(), 60 * 1000).unref();
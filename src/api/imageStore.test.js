@@ -0,0 +1,87 @@
+/**
+ * @jest-environment node
+ */
+import { ImageStore } from './imageStore';
+
+const bytes = (n, fill = 1) => Buffer.alloc(n, fill);
+
+test('the least recently used image is evicted once the entry cap is reached', () => {
+  const store = new ImageStore({ maxEntries: 2, maxBytes: 1000, ttlMs: 60000 });
+  const a = store.put(bytes(10));
+  const b = store.put(bytes(10));
+
+  store.get(a); // a is now more recent than b
+  const c = store.put(bytes(10));
+
+  expect(store.get(b)).toBe(null);
+  expect(store.get(a).buffer.length).toBe(10);
+  expect(store.get(c).buffer.length).toBe(10);
+  expect(store.stats()).toMatchObject({ entries: 2, bytes: 20, evictions: 1 });
+});
+
+test('images are evicted until the total size fits the byte cap', () => {
+  const store = new ImageStore({ maxEntries: 10, maxBytes: 100, ttlMs: 60000 });
+  const a = store.put(bytes(40));
+  const b = store.put(bytes(40));
+  const c = store.put(bytes(70));
+
+  expect(store.get(a)).toBe(null);
+  expect(store.get(b)).toBe(null);
+  expect(store.get(c).buffer.length).toBe(70);
+  expect(store.stats()).toMatchObject({ entries: 1, bytes: 70, evictions: 2 });
+});
+
+test('an image larger than the whole store is refused', () => {
+  const store = new ImageStore({ maxEntries: 10, maxBytes: 100, ttlMs: 60000 });
+
+  let error;
+  try {
+    store.put(bytes(101));
+  } catch (caught) {
+    error = caught;
+  }
+  expect(error.message).toBe('Image is larger than the image store capacity.');
+});
+
+test('images expire after the TTL without being read, and reads extend it', () => {
+  let now = 1000;
+  const clock = jest.spyOn(Date, 'now').mockImplementation(() => now);
+  const store = new ImageStore({ maxEntries: 10, maxBytes: 1000, ttlMs: 100 });
+  const kept = store.put(bytes(10));
+  const idle = store.put(bytes(10));
+
+  now = 1050;
+  store.get(kept);
+  now = 1120;
+  expect(store.get(idle)).toBe(null);
+  expect(store.get(kept).buffer.length).toBe(10);
+
+  now = 1300;
+  store.evict();
+  expect(store.stats()).toMatchObject({ entries: 0, bytes: 0, expirations: 2 });
+  clock.mockRestore();
+});
+
+test('derived handles are remembered per operation and parameters, until evicted', () => {
+  const store = new ImageStore({ maxEntries: 2, maxBytes: 1000, ttlMs: 60000 });
+  const source = store.put(bytes(10));
+  const resized = store.put(bytes(5));
+  store.setDerived(source, 'transform', { width: 100, height: 50 }, resized);
+
+  expect(store.getDerived(source, 'transform', { height: 50, width: 100 })).toBe(resized);
+  expect(store.getDerived(source, 'transform', { width: 200 })).toBe(null);
+  expect(store.stats().derivedHits).toBe(1);
+
+  // Two more images push the derived one out; the mapping is dropped with it.
+  store.get(source);
+  store.put(bytes(1));
+  expect(store.getDerived(source, 'transform', { width: 100, height: 50 })).toBe(null);
+});
+
+test('stored images keep their content hash', () => {
+  const store = new ImageStore({ maxEntries: 10, maxBytes: 1000, ttlMs: 60000 });
+
+  expect(store.get(store.put(bytes(3, 0))).hash)
+    .toBe('709e80c88487a2411e1ee4dfb9f22a861492d20c4765150c0c794abd70f8147c');
+  expect(store.get(store.put(bytes(3), 'image/png', 'known')).hash).toBe('known');
+});
@@ -0,0 +1,57 @@
+import { logger } from './logger.js';
+import { SIZE_BUCKETS, metrics } from './metrics.js';
+import { runInTrace, startTrace } from './tracing.js';
+
+/**
+ * Express middleware shared by both API servers. For every request it:
+ *
+ * - records latency in `http_request_duration_seconds` and payload sizes in
+ *   `http_request_size_bytes` / `http_response_size_bytes`, labelled by the
+ *   route pattern (e.g. /api/images/:handle) so label values stay bounded;
+ * - starts a trace (continuing an incoming `traceparent`) that spans created
+ *   while handling the request attach to, and returns its id in X-Trace-Id;
+ * - logs one structured `request` line, sampled for successful requests and
+ *   always written for 5xx responses.
+ *
+ * Register it before the routes.
+ */
+export const instrumentRequests = ({ registry = metrics, log = logger } = {}) => {
+  const duration = registry.histogram('http_request_duration_seconds',
+    'HTTP request latency by route.', { labelNames: ['method', 'route', 'status'] });
+  const requestSize = registry.histogram('http_request_size_bytes',
+    'HTTP request body size by route.', { labelNames: ['method', 'route'], buckets: SIZE_BUCKETS });
+  const responseSize = registry.histogram('http_response_size_bytes',
+    'HTTP response body size by route.', { labelNames: ['method', 'route'], buckets: SIZE_BUCKETS });
+
+  return (req, res, next) => {
+    const start = process.hrtime.bigint();
+    const trace = startTrace(req.get('traceparent'));
+    res.set('X-Trace-Id', trace.traceId);
+
+    res.on('finish', () => {
+      const seconds = Number(process.hrtime.bigint() - start) / 1e9;
+      // Unmatched paths share one label value rather than one per URL.
+      const route = req.route ? `${req.baseUrl}${req.route.path}` : 'unmatched';
+      const status = res.statusCode;
+      const bytesIn = Number(req.get('content-length')) || 0;
+      const bytesOut = Number(res.get('content-length')) || 0;
+
+      duration.observe({ method: req.method, route, status }, seconds);
+      requestSize.observe({ method: req.method, route }, bytesIn);
+      responseSize.observe({ method: req.method, route }, bytesOut);
+
+      log.log(status >= 500 ? 'error' : 'info', 'request', {
+        trace_id: trace.traceId,
+        method: req.method,
+        route,
+        path: req.path,
+        status,
+        duration_ms: Math.round(seconds * 1e6) / 1e3,
+        bytes_in: bytesIn,
+        bytes_out: bytesOut,
+      }, { sampled: status < 500 });
+    });
+
+    runInTrace(trace, next);
+  };
+};
@@ -0,0 +1,169 @@
+import os from 'os';
+
+const CORES = typeof os.availableParallelism === 'function' ? os.availableParallelism() : os.cpus().length;
+
+// Queue sizing; IMAGE_JOB_* variables override the core-count based defaults.
+const DEFAULT_CONCURRENCY = Number(process.env.IMAGE_JOB_CONCURRENCY) || Math.max(1, Math.floor(CORES / 2));
+const DEFAULT_MAX_QUEUE = Number(process.env.IMAGE_JOB_MAX_QUEUE) || DEFAULT_CONCURRENCY * 8;
+const DEFAULT_QUEUE_TIMEOUT_MS = Number(process.env.IMAGE_JOB_QUEUE_TIMEOUT_MS) || 30 * 1000;
+
+// How many recent samples to keep for the wait/run time percentiles.
+const SAMPLE_SIZE = 200;
+
+// Thrown when a job can't be accepted (queue full) or waited too long to start.
+// `retryAfter` is a suggested delay, in seconds, for the Retry-After header.
+export class QueueSaturatedError extends Error {
+  constructor(message, retryAfter) {
+    super(message);
+    this.retryAfter = retryAfter;
+  }
+}
+
+// Nearest-rank percentile (`p` in 0-100) of a list of samples; 0 when empty.
+export const percentile = (samples, p) => {
+  if (samples.length === 0) {
+    return 0;
+  }
+  const sorted = [...samples].sort((a, b) => a - b);
+  return sorted[Math.max(0, Math.min(sorted.length - 1, Math.ceil((p / 100) * sorted.length) - 1))];
+};
+
+const pushSample = (samples, value) => {
+  samples.push(value);
+  if (samples.length > SAMPLE_SIZE) {
+    samples.shift();
+  }
+};
+
+/**
+ * Concurrency limiter for CPU-heavy jobs.
+ *
+ * At most `concurrency` jobs run at once and at most `maxQueue` wait behind them.
+ * Jobs beyond that are rejected straight away, and queued jobs that haven't
+ * started within `queueTimeoutMs` are rejected too, both with a QueueSaturatedError.
+ */
+export class JobQueue {
+  constructor({
+    concurrency = DEFAULT_CONCURRENCY,
+    maxQueue = DEFAULT_MAX_QUEUE,
+    queueTimeoutMs = DEFAULT_QUEUE_TIMEOUT_MS,
+  } = {}) {
+    this.concurrency = concurrency;
+    this.maxQueue = maxQueue;
+    this.queueTimeoutMs = queueTimeoutMs;
+    this.active = 0;
+    // Requests admitted by the middleware that haven't finished yet (including
+    // ones still uploading their body), so always >= active + waiting.
+    this.pending = 0;
+    this.waiting = [];
+    this.waitSamples = [];
+    this.runSamples = [];
+    this.counters = { completed: 0, failed: 0, rejected: 0, timedOut: 0 };
+  }
+
+  // Rough number of seconds until a new job could start, based on recent run times.
+  retryAfterSeconds() {
+    const averageRunMs = this.runSamples.length > 0
+      ? this.runSamples.reduce((sum, ms) => sum + ms, 0) / this.runSamples.length
+      : 1000;
+    const seconds = Math.ceil(((this.waiting.length + 1) * averageRunMs) / this.concurrency / 1000);
+    return Math.min(60, Math.max(1, seconds));
+  }
+
+  // Runs `job` (an async function) once a slot is free and resolves with its result.
+  run(job) {
+    if (this.active < this.concurrency) {
+      return this.start(job, process.hrtime.bigint());
+    }
+    if (this.waiting.length >= this.maxQueue) {
+      this.counters.rejected++;
+      return Promise.reject(new QueueSaturatedError('Image processing queue is full.', this.retryAfterSeconds()));
+    }
+
+    return new Promise((resolve, reject) => {
+      const entry = { job, resolve, reject, queuedAt: process.hrtime.bigint() };
+      entry.timer = setTimeout(() => {
+        this.waiting.splice(this.waiting.indexOf(entry), 1);
+        this.counters.timedOut++;
+        reject(new QueueSaturatedError('Timed out waiting for an image processing slot.', this.retryAfterSeconds()));
+      }, this.queueTimeoutMs);
+      this.waiting.push(entry);
+    });
+  }
+
+  async start(job, queuedAt) {
+    const startedAt = process.hrtime.bigint();
+    pushSample(this.waitSamples, Number(startedAt - queuedAt) / 1e6);
+    this.active++;
+    try {
+      const result = await job();
+      this.counters.completed++;
+      return result;
+    } catch (error) {
+      this.counters.failed++;
+      throw error;
+    } finally {
+      pushSample(this.runSamples, Number(process.hrtime.bigint() - startedAt) / 1e6);
+      this.active--;
+      this.next();
+    }
+  }
+
+  next() {
+    const entry = this.waiting.shift();
+    if (entry) {
+      clearTimeout(entry.timer);
+      this.start(entry.job, entry.queuedAt).then(entry.resolve, entry.reject);
+    }
+  }
+
+  // Express middleware that admits a request only while there is room for it,
+  // counting requests whose bodies are still being read. Turning requests away
+  // here, before multer or express.raw buffer the upload, is what bounds memory
+  // under a burst of large uploads.
+  middleware() {
+    return (req, res, next) => {
+      if (this.pending >= this.concurrency + this.maxQueue) {
+        this.counters.rejected++;
+        return res.status(429)
+          .set('Retry-After', String(this.retryAfterSeconds()))
+          .json({
+            error: 'Too many image requests in progress. Please try again shortly.'
+          });
+      }
+
+      this.pending++;
+      res.once('close', () => {
+        this.pending--;
+      });
+      return next();
+    };
+  }
+
+  stats() {
+    return {
+      concurrency: this.concurrency,
+      maxQueue: this.maxQueue,
+      pending: this.pending,
+      active: this.active,
+      waiting: this.waiting.length,
+      ...this.counters,
+      waitMs: {
+        p50: percentile(this.waitSamples, 50),
+        p95: percentile(this.waitSamples, 95),
+        max: this.waitSamples.length > 0 ? Math.max(...this.waitSamples) : 0,
+      },
+      runMs: {
+        p50: percentile(this.runSamples, 50),
+        p95: percentile(this.runSamples, 95),
+      },
+    };
+  }
+}
+
+// Shared queue for the sharp-backed image routes.
+export const imageQueue = new JobQueue();
+
+// libvips threads per image, so that a full set of concurrent jobs roughly fills
+// the cores instead of oversubscribing them.
+export const sharpThreadsPerJob = () => Math.max(1, Math.floor(CORES / imageQueue.concurrency));
@@ -0,0 +1,133 @@
+/**
+ * @jest-environment node
+ */
+import { EventEmitter } from 'events';
+import { JobQueue, QueueSaturatedError, percentile } from './jobQueue';
+
+// A job that runs until the test finishes it.
+const deferred = () => {
+  let finish;
+  const done = new Promise((resolve) => {
+    finish = resolve;
+  });
+  return { job: () => done, finish };
+};
+
+const rejection = async (promise) => {
+  try {
+    await promise;
+  } catch (error) {
+    return error;
+  }
+  return null;
+};
+
+// Minimal Express response: status/set/json chain plus the 'close' event.
+const fakeResponse = () => {
+  const res = new EventEmitter();
+  res.headers = {};
+  res.status = (code) => {
+    res.statusCode = code;
+    return res;
+  };
+  res.set = (name, value) => {
+    res.headers[name] = value;
+    return res;
+  };
+  res.json = (body) => {
+    res.body = body;
+    return res;
+  };
+  return res;
+};
+
+test('percentiles use the nearest rank and are 0 without samples', () => {
+  expect(percentile([], 50)).toBe(0);
+  expect(percentile([5, 1, 4, 2, 3], 50)).toBe(3);
+  expect(percentile([5, 1, 4, 2, 3], 95)).toBe(5);
+  expect(percentile([5, 1, 4, 2, 3], 0)).toBe(1);
+  expect(percentile([4, 1, 3, 2], 50)).toBe(2);
+  expect(percentile([4, 1, 3, 2], 75)).toBe(3);
+  expect(percentile([4, 1, 3, 2], 100)).toBe(4);
+  expect(percentile([7], 99)).toBe(7);
+});
+
+test('jobs run up to the concurrency limit and the rest start as slots free up', async () => {
+  const queue = new JobQueue({ concurrency: 2, maxQueue: 5, queueTimeoutMs: 60000 });
+  const first = deferred();
+  const second = deferred();
+  const third = deferred();
+
+  const results = [queue.run(first.job), queue.run(second.job), queue.run(third.job)];
+  expect(queue.stats()).toMatchObject({ active: 2, waiting: 1 });
+
+  first.finish('a');
+  expect(await results[0]).toBe('a');
+  expect(queue.stats()).toMatchObject({ active: 2, waiting: 0 });
+
+  second.finish('b');
+  third.finish('c');
+  expect(await Promise.all(results)).toEqual(['a', 'b', 'c']);
+  expect(queue.stats()).toMatchObject({ active: 0, waiting: 0, completed: 3, failed: 0 });
+});
+
+test('a job is rejected straight away once the queue is full', async () => {
+  const queue = new JobQueue({ concurrency: 1, maxQueue: 1, queueTimeoutMs: 60000 });
+  const running = deferred();
+  const queued = deferred();
+  const results = [queue.run(running.job), queue.run(queued.job)];
+
+  const error = await rejection(queue.run(() => Promise.resolve('never')));
+  expect(error instanceof QueueSaturatedError).toBe(true);
+  expect(error.message).toBe('Image processing queue is full.');
+  expect(error.retryAfter).toBe(2);
+  expect(queue.stats()).toMatchObject({ rejected: 1, waiting: 1 });
+
+  running.finish();
+  queued.finish();
+  await Promise.all(results);
+});
+
+test('queued jobs that do not start in time are rejected', async () => {
+  const queue = new JobQueue({ concurrency: 1, maxQueue: 5, queueTimeoutMs: 10 });
+  const running = deferred();
+  const result = queue.run(running.job);
+  const job = jest.fn();
+
+  const error = await rejection(queue.run(job));
+  expect(error instanceof QueueSaturatedError).toBe(true);
+  expect(error.message).toBe('Timed out waiting for an image processing slot.');
+  expect(queue.stats()).toMatchObject({ timedOut: 1, waiting: 0, active: 1 });
+
+  running.finish();
+  await result;
+  expect(job).toHaveBeenCalledTimes(0);
+});
+
+test('the middleware answers 429 once pending requests fill the running and queued slots', () => {
+  const queue = new JobQueue({ concurrency: 1, maxQueue: 1, queueTimeoutMs: 60000 });
+  const admit = queue.middleware();
+  const next = jest.fn();
+  const admitted = [fakeResponse(), fakeResponse()];
+
+  admitted.forEach((res) => admit({}, res, next));
+  expect(next).toHaveBeenCalledTimes(2);
+  expect(queue.stats().pending).toBe(2);
+
+  const refused = fakeResponse();
+  admit({}, refused, next);
+  expect(next).toHaveBeenCalledTimes(2);
+  expect(refused.statusCode).toBe(429);
+  expect(refused.headers).toEqual({ 'Retry-After': '1' });
+  expect(refused.body).toEqual({ error: 'Too many image requests in progress. Please try again shortly.' });
+  expect(queue.stats()).toMatchObject({ pending: 2, rejected: 1 });
+
+  // A closed response frees its slot (once, even if 'close' fires again).
+  admitted[0].emit('close');
+  admitted[0].emit('close');
+  expect(queue.stats().pending).toBe(1);
+
+  admit({}, fakeResponse(), next);
+  expect(next).toHaveBeenCalledTimes(3);
+  expect(queue.stats().pending).toBe(2);
+});
@@ -0,0 +1,137 @@
+import fs from 'fs';
+
+const LEVELS = { debug: 10, info: 20, warn: 30, error: 40 };
+
+// LOG_LEVEL, LOG_SAMPLE_RATE and LOG_MAX_BUFFERED tune the shared logger.
+const DEFAULT_LEVEL = LEVELS[process.env.LOG_LEVEL] ? process.env.LOG_LEVEL : 'info';
+// Fraction of sampled (per-request) lines that are written. 0 turns them off.
+const DEFAULT_SAMPLE_RATE = process.env.LOG_SAMPLE_RATE !== undefined
+  ? Math.min(1, Math.max(0, Number(process.env.LOG_SAMPLE_RATE) || 0))
+  : 0.1;
+// Lines kept in memory while the output stream is busy; beyond that they are dropped.
+const DEFAULT_MAX_BUFFERED = Number(process.env.LOG_MAX_BUFFERED) || 1000;
+
+// Errors don't survive JSON.stringify, so spell out the useful parts.
+const serialize = (value) => (value instanceof Error
+  ? { name: value.name, message: value.message, stack: value.stack }
+  : value);
+
+/**
+ * Structured JSON logger that never blocks the request path.
+ *
+ * Every line is one JSON object ({ time, level, msg, pid, ...fields }). Lines are
+ * buffered and written in one chunk per event-loop turn; while the stream is
+ * applying backpressure at most `maxBuffered` lines are kept and the rest are
+ * dropped (and counted) rather than letting memory or latency grow. High-volume
+ * lines, such as one per request, can be logged with `{ sampled: true }` so only
+ * `sampleRate` of them are written.
+ */
+export class Logger {
+  constructor({
+    level = DEFAULT_LEVEL,
+    sampleRate = DEFAULT_SAMPLE_RATE,
+    maxBuffered = DEFAULT_MAX_BUFFERED,
+    stream = process.stdout,
+  } = {}) {
+    this.level = level;
+    this.sampleRate = sampleRate;
+    this.maxBuffered = maxBuffered;
+    this.stream = stream;
+    this.buffered = [];
+    this.scheduled = false;
+    this.waitingForDrain = false;
+    this.counters = { written: 0, sampledOut: 0, dropped: 0 };
+  }
+
+  log(level, message, fields = {}, { sampled = false } = {}) {
+    if (LEVELS[level] < LEVELS[this.level]) {
+      return;
+    }
+    if (sampled && Math.random() >= this.sampleRate) {
+      this.counters.sampledOut++;
+      return;
+    }
+    if (this.buffered.length >= this.maxBuffered) {
+      this.counters.dropped++;
+      return;
+    }
+
+    const line = { time: new Date().toISOString(), level, msg: message, pid: process.pid };
+    for (const key of Object.keys(fields)) {
+      line[key] = serialize(fields[key]);
+    }
+    if (sampled) {
+      line.sample_rate = this.sampleRate;
+    }
+    this.buffered.push(`${JSON.stringify(line)}\n`);
+    this.counters.written++;
+
+    if (!this.scheduled && !this.waitingForDrain) {
+      this.scheduled = true;
+      setImmediate(() => this.flush());
+    }
+  }
+
+  debug(message, fields) {
+    this.log('debug', message, fields);
+  }
+
+  info(message, fields) {
+    this.log('info', message, fields);
+  }
+
+  warn(message, fields) {
+    this.log('warn', message, fields);
+  }
+
+  error(message, fields) {
+    this.log('error', message, fields);
+  }
+
+  // Writes the buffered lines as one chunk, pausing while the stream drains.
+  flush() {
+    this.scheduled = false;
+    if (this.buffered.length === 0 || this.waitingForDrain) {
+      return;
+    }
+    const chunk = this.buffered.join('');
+    this.buffered = [];
+    if (!this.stream.write(chunk)) {
+      this.waitingForDrain = true;
+      this.stream.once('drain', () => {
+        this.waitingForDrain = false;
+        this.flush();
+      });
+    }
+  }
+
+  // Synchronous flush for process exit, so the last lines (e.g. a fatal error) aren't lost.
+  flushSync() {
+    if (this.buffered.length === 0) {
+      return;
+    }
+    const chunk = this.buffered.join('');
+    this.buffered = [];
+    if (typeof this.stream.fd === 'number') {
+      try {
+        fs.writeSync(this.stream.fd, chunk);
+      } catch (error) {
+        // Nothing left to report to.
+      }
+    }
+  }
+
+  stats() {
+    return {
+      level: this.level,
+      sampleRate: this.sampleRate,
+      buffered: this.buffered.length,
+      ...this.counters,
+    };
+  }
+}
+
+// Shared logger used by both API servers.
+export const logger = new Logger();
+
+process.on('exit', () => logger.flushSync());
@@ -0,0 +1,231 @@
+import { monitorEventLoopDelay } from 'perf_hooks';
+import { logger } from './logger.js';
+
+// Latency buckets in seconds, and payload size buckets in bytes.
+export const DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30];
+export const SIZE_BUCKETS = [256, 1024, 10 * 1024, 100 * 1024, 1024 * 1024, 5 * 1024 * 1024, 25 * 1024 * 1024];
+
+const escapeLabel = (value) => String(value).replace(/\\/g, '\\\\').replace(/"/g, '\\"').replace(/\n/g, '\\n');
+
+const formatLabels = (names, values, extra = '') => {
+  const pairs = names.map((name, i) => `${name}="${escapeLabel(values[i])}"`);
+  if (extra) {
+    pairs.push(extra);
+  }
+  return pairs.length > 0 ? `{${pairs.join(',')}}` : '';
+};
+
+// One time series per distinct combination of label values.
+class Metric {
+  constructor(type, name, help, labelNames = []) {
+    this.type = type;
+    this.name = name;
+    this.help = help;
+    this.labelNames = labelNames;
+    this.series = new Map();
+  }
+
+  labelValues(labels = {}) {
+    return this.labelNames.map((name) => (labels[name] === undefined ? '' : String(labels[name])));
+  }
+
+  seriesFor(labels) {
+    const values = this.labelValues(labels);
+    const key = JSON.stringify(values);
+    let series = this.series.get(key);
+    if (!series) {
+      series = this.createSeries(values);
+      this.series.set(key, series);
+    }
+    return series;
+  }
+
+  render() {
+    const lines = [`# HELP ${this.name} ${this.help}`, `# TYPE ${this.name} ${this.type}`];
+    for (const series of this.series.values()) {
+      lines.push(...this.renderSeries(series));
+    }
+    return lines;
+  }
+}
+
+export class Counter extends Metric {
+  constructor(name, help, labelNames) {
+    super('counter', name, help, labelNames);
+  }
+
+  createSeries(values) {
+    return { values, value: 0 };
+  }
+
+  inc(labels, amount = 1) {
+    this.seriesFor(labels).value += amount;
+  }
+
+  // For counters mirrored from a component that keeps its own running totals.
+  set(labels, value) {
+    this.seriesFor(labels).value = value;
+  }
+
+  renderSeries({ values, value }) {
+    return [`${this.name}${formatLabels(this.labelNames, values)} ${value}`];
+  }
+}
+
+export class Gauge extends Counter {
+  constructor(name, help, labelNames) {
+    super(name, help, labelNames);
+    this.type = 'gauge';
+  }
+}
+
+export class Histogram extends Metric {
+  constructor(name, help, labelNames, buckets = DURATION_BUCKETS) {
+    super('histogram', name, help, labelNames);
+    this.buckets = [...buckets].sort((a, b) => a - b);
+  }
+
+  createSeries(values) {
+    return { values, counts: new Array(this.buckets.length).fill(0), sum: 0, count: 0 };
+  }
+
+  observe(labels, value) {
+    const series = this.seriesFor(labels);
+    // Counts are per bucket here and made cumulative when rendered.
+    const index = this.buckets.findIndex((bound) => value <= bound);
+    if (index !== -1) {
+      series.counts[index]++;
+    }
+    series.sum += value;
+    series.count++;
+  }
+
+  renderSeries({ values, counts, sum, count }) {
+    const lines = [];
+    let cumulative = 0;
+    this.buckets.forEach((bound, i) => {
+      cumulative += counts[i];
+      lines.push(`${this.name}_bucket${formatLabels(this.labelNames, values, `le="${bound}"`)} ${cumulative}`);
+    });
+    lines.push(`${this.name}_bucket${formatLabels(this.labelNames, values, 'le="+Inf"')} ${count}`);
+    lines.push(`${this.name}_sum${formatLabels(this.labelNames, values)} ${sum}`);
+    lines.push(`${this.name}_count${formatLabels(this.labelNames, values)} ${count}`);
+    return lines;
+  }
+}
+
+/**
+ * Registry of counters, gauges and histograms, rendered in the Prometheus text format.
+ *
+ * Metrics are created on first use and returned again for the same name, so
+ * modules can declare the metrics they record without coordinating. Values that
+ * other components already track (cache counters, queue lengths, memory) are read
+ * by collectors registered with `onCollect`, which run before every scrape.
+ */
+export class MetricsRegistry {
+  constructor() {
+    this.metrics = new Map();
+    this.collectors = [];
+  }
+
+  getOrCreate(name, create) {
+    let metric = this.metrics.get(name);
+    if (!metric) {
+      metric = create();
+      this.metrics.set(name, metric);
+    }
+    return metric;
+  }
+
+  counter(name, help, { labelNames = [] } = {}) {
+    return this.getOrCreate(name, () => new Counter(name, help, labelNames));
+  }
+
+  gauge(name, help, { labelNames = [] } = {}) {
+    return this.getOrCreate(name, () => new Gauge(name, help, labelNames));
+  }
+
+  histogram(name, help, { labelNames = [], buckets } = {}) {
+    return this.getOrCreate(name, () => new Histogram(name, help, labelNames, buckets));
+  }
+
+  onCollect(collector) {
+    this.collectors.push(collector);
+  }
+
+  render() {
+    for (const collector of this.collectors) {
+      try {
+        collector(this);
+      } catch (error) {
+        logger.error('Error collecting metrics', { error });
+      }
+    }
+    const lines = [];
+    for (const metric of this.metrics.values()) {
+      lines.push(...metric.render());
+    }
+    return `${lines.join('\n')}\n`;
+  }
+
+  // Express handler serving the metrics to a Prometheus scraper.
+  handler() {
+    return (req, res) => {
+      res.set('Cache-Control', 'no-store');
+      res.type('text/plain; version=0.0.4').send(this.render());
+    };
+  }
+}
+
+// Shared registry used by both API servers.
+export const metrics = new MetricsRegistry();
+
+// The process's one event-loop delay monitor, sampled every 20ms.
+const EVENT_LOOP_RESOLUTION_MS = 20;
+const eventLoopDelay = monitorEventLoopDelay({ resolution: EVENT_LOOP_RESOLUTION_MS });
+eventLoopDelay.enable();
+
+/**
+ * Reads the event-loop delay, in milliseconds, since the monitor was last reset.
+ *
+ * Every sample includes the 20ms sampling interval, which is subtracted here.
+ * Readers that pass `reset: true` start a new window for everyone: /metrics does
+ * on every scrape, and /api/stats does when asked to (e.g. by the benchmarks).
+ *
+ * @returns {{ meanMs: number, p50Ms: number, p99Ms: number, maxMs: number }}
+ */
+export const readEventLoopDelay = ({ reset = false } = {}) => {
+  const delayMs = (nanoseconds) => Math.max(0, (nanoseconds || 0) / 1e6 - EVENT_LOOP_RESOLUTION_MS);
+  const delay = {
+    meanMs: delayMs(eventLoopDelay.mean),
+    p50Ms: delayMs(eventLoopDelay.percentile(50)),
+    p99Ms: delayMs(eventLoopDelay.percentile(99)),
+    maxMs: delayMs(eventLoopDelay.max),
+  };
+  if (reset) {
+    eventLoopDelay.reset();
+  }
+  return delay;
+};
+
+metrics.onCollect((registry) => {
+  const memory = process.memoryUsage();
+  registry.gauge('process_resident_memory_bytes', 'Resident set size in bytes.').set({}, memory.rss);
+  registry.gauge('nodejs_heap_used_bytes', 'V8 heap in use, in bytes.').set({}, memory.heapUsed);
+  registry.gauge('nodejs_heap_total_bytes', 'V8 heap allocated, in bytes.').set({}, memory.heapTotal);
+  registry.gauge('nodejs_external_memory_bytes', 'Memory held by buffers and other C++ objects, in bytes.')
+    .set({}, memory.external);
+
+  const loop = readEventLoopDelay({ reset: true });
+  const delay = registry.gauge('nodejs_eventloop_delay_seconds',
+    'Event-loop delay since the previous scrape.', { labelNames: ['quantile'] });
+  delay.set({ quantile: '0.5' }, loop.p50Ms / 1000);
+  delay.set({ quantile: '0.99' }, loop.p99Ms / 1000);
+  delay.set({ quantile: '1' }, loop.maxMs / 1000);
+
+  const logs = logger.stats();
+  const lines = registry.counter('log_lines_total', 'Log lines by outcome.', { labelNames: ['outcome'] });
+  lines.set({ outcome: 'written' }, logs.written);
+  lines.set({ outcome: 'sampled_out' }, logs.sampledOut);
+  lines.set({ outcome: 'dropped' }, logs.dropped);
+});
@@ -0,0 +1,64 @@
+/**
+ * @jest-environment node
+ */
+import { MetricsRegistry } from './metrics';
+import { Logger } from './logger';
+
+test('histograms render cumulative buckets, sum and count per label set', () => {
+  const registry = new MetricsRegistry();
+  const latency = registry.histogram('request_seconds', 'Request latency.', {
+    labelNames: ['route'],
+    buckets: [0.1, 1],
+  });
+
+  latency.observe({ route: '/api/posters' }, 0.05);
+  latency.observe({ route: '/api/posters' }, 0.5);
+  latency.observe({ route: '/api/posters' }, 2);
+
+  const text = registry.render();
+  expect(text).toContain('# TYPE request_seconds histogram');
+  expect(text).toContain('request_seconds_bucket{route="/api/posters",le="0.1"} 1');
+  expect(text).toContain('request_seconds_bucket{route="/api/posters",le="1"} 2');
+  expect(text).toContain('request_seconds_bucket{route="/api/posters",le="+Inf"} 3');
+  expect(text).toContain('request_seconds_sum{route="/api/posters"} 2.55');
+  expect(text).toContain('request_seconds_count{route="/api/posters"} 3');
+});
+
+test('metrics are created once per name and collectors run on every render', () => {
+  const registry = new MetricsRegistry();
+  let hits = 0;
+  registry.onCollect(() => {
+    registry.counter('cache_hits_total', 'Cache hits.').set({}, hits);
+  });
+
+  expect(registry.counter('cache_hits_total', 'Cache hits.')).toBe(registry.counter('cache_hits_total', 'Cache hits.'));
+  hits = 7;
+  expect(registry.render()).toContain('cache_hits_total 7');
+});
+
+test('label values are escaped', () => {
+  const registry = new MetricsRegistry();
+  registry.gauge('info', 'Info.', { labelNames: ['path'] }).set({ path: 'a"b\\c' }, 1);
+
+  expect(registry.render()).toContain('info{path="a\\"b\\\\c"} 1');
+});
+
+test('the logger writes JSON lines asynchronously and drops lines beyond its buffer', async () => {
+  const chunks = [];
+  const stream = { write: (chunk) => chunks.push(chunk) };
+  const logger = new Logger({ stream, maxBuffered: 2, sampleRate: 0 });
+
+  logger.info('first', { route: '/api/posters' });
+  logger.error('second', { error: new Error('boom') });
+  logger.info('third');
+  logger.log('info', 'sampled', {}, { sampled: true });
+  expect(chunks).toHaveLength(0);
+
+  await new Promise((resolve) => setImmediate(resolve));
+
+  const lines = chunks.join('').trim().split('\n').map((line) => JSON.parse(line));
+  expect(lines).toHaveLength(2);
+  expect(lines[0]).toMatchObject({ level: 'info', msg: 'first', route: '/api/posters' });
+  expect(lines[1].error.message).toBe('boom');
+  expect(logger.stats()).toMatchObject({ written: 2, dropped: 1, sampledOut: 1 });
+});
@@ -0,0 +1,284 @@
+import crypto from 'crypto';
+import { logger } from './logger.js';
+import { posterDerivatives } from './posterImages.js';
+
+const DEFAULT_TTL_MS = 5 * 60 * 1000;
+const DEFAULT_PAGE_SIZE = 24;
+const MAX_PAGE_SIZE = 100;
+// How many pre-serialized page slices to keep per snapshot.
+const MAX_CACHED_PAGES = 100;
+
+const etagFor = (body) => `"${crypto.createHash('sha1').update(body).digest('base64url')}"`;
+
+// Turns a Cloudinary public_id such as "portfolio/summer_sale-poster" into "Summer Sale Poster".
+export const titleFromPublicId = (publicId) => {
+  const fileName = publicId.split('/').pop();
+  return fileName
+    .replace(/[-_]/g, ' ')
+    .replace(/\.\w+$/, '')
+    .split(' ')
+    .map(word => word.charAt(0).toUpperCase() + word.slice(1))
+    .join(' ');
+};
+
+/**
+ * Poster source backed by the Cloudinary Search API.
+ *
+ * `search` runs one search request and resolves with Cloudinary's response
+ * ({ resources, next_cursor }). Keeping it injectable lets tests use a local
+ * fake instead of the real API. Every page of the folder is loaded by following
+ * `next_cursor`, and mapped posters (including their derivative URLs) are reused
+ * across refreshes for resources whose version hasn't changed.
+ *
+ * @param {object} options
+ * @param {function} options.search - async ({ expression, maxResults, cursor }) => search response.
+ * @param {string} options.folder - The Cloudinary folder to list.
+ * @param {function} [options.mapResource] - Maps a resource to the poster sent to the frontend.
+ * @returns {function} An async function resolving with the full poster list.
+ */
+export const createCloudinaryPosterSource = ({
+  search,
+  folder,
+  mapResource = (resource) => ({
+    id: resource.public_id,
+    imageUrl: resource.secure_url,
+    title: titleFromPublicId(resource.public_id) || 'Untitled Poster',
+    // srcset-ready width variants, intrinsic size and a placeholder for the gallery
+    ...posterDerivatives(resource),
+  }),
+}) => {
+  let mapped = new Map();
+
+  return async () => {
+    const resources = [];
+    let cursor;
+    do {
+      const result = await search({
+        expression: `folder:"${folder}"`,
+        maxResults: 500, // Cloudinary's maximum per request
+        cursor,
+      });
+      resources.push(...((result && result.resources) || []));
+      cursor = result && result.next_cursor;
+    } while (cursor);
+
+    if (resources.length === 0) {
+      logger.warn('No resources found in Cloudinary folder', { folder });
+    }
+
+    // Only map resources that are new or have a new version since the last refresh.
+    const nextMapped = new Map();
+    const posters = resources.map((resource) => {
+      const key = `${resource.public_id}@${resource.version}`;
+      const poster = mapped.get(key) || mapResource(resource);
+      nextMapped.set(key, poster);
+      return poster;
+    });
+    mapped = nextMapped;
+    return posters;
+  };
+};
+
+/**
+ * Poster source that loads a JSON array from a URL (e.g. a Google Apps Script web app).
+ *
+ * @param {object} options
+ * @param {string} options.url - The URL returning the poster array.
+ * @param {function} [options.fetchImpl] - fetch implementation, injectable for tests.
+ * @returns {function} An async function resolving with the full poster list.
+ */
+export const createJsonPosterSource = ({ url, fetchImpl = fetch }) => async () => {
+  const response = await fetchImpl(url);
+  if (!response.ok) {
+    throw new Error(`Poster source responded with HTTP ${response.status}.`);
+  }
+  const posters = await response.json();
+  if (!Array.isArray(posters)) {
+    throw new Error('Poster source did not return an array.');
+  }
+  return posters;
+};
+
+/**
+ * In-memory poster catalogue with stale-while-revalidate caching.
+ *
+ * Fresh snapshots are served straight from memory. Once a snapshot is older
+ * than `ttlMs` it is still served, while a single background refresh replaces
+ * it; only when it is older than `ttlMs + maxStaleMs` (or there is none yet)
+ * do requests wait for the source. If a refresh fails, the previous snapshot
+ * keeps being served. Responses are serialized once per snapshot and page, and
+ * carry an ETag so unchanged catalogues are answered with 304.
+ */
+export class PosterCatalogue {
+  constructor({
+    source,
+    ttlMs = DEFAULT_TTL_MS,
+    maxStaleMs = 12 * DEFAULT_TTL_MS,
+    pageSize = DEFAULT_PAGE_SIZE,
+    now = Date.now,
+  }) {
+    this.source = source;
+    this.ttlMs = ttlMs;
+    this.maxStaleMs = maxStaleMs;
+    this.pageSize = pageSize;
+    this.now = now;
+    this.snapshot = null;
+    this.refreshing = null;
+    this.counters = { hits: 0, staleHits: 0, misses: 0, refreshes: 0, refreshErrors: 0 };
+  }
+
+  // Loads the posters from the source, sharing one in-flight load between callers.
+  refresh() {
+    if (!this.refreshing) {
+      this.refreshing = (async () => {
+        try {
+          const posters = await this.source();
+          const body = JSON.stringify(posters);
+          const etag = etagFor(body);
+          this.counters.refreshes++;
+
+          if (this.snapshot && this.snapshot.etag === etag) {
+            // Nothing changed: keep the existing serialized pages.
+            this.snapshot.fetchedAt = this.now();
+          } else {
+            this.snapshot = {
+              posters,
+              all: { body, etag },
+              etag,
+              pages: new Map(),
+              fetchedAt: this.now(),
+            };
+          }
+          return this.snapshot;
+        } catch (error) {
+          this.counters.refreshErrors++;
+          throw error;
+        } finally {
+          this.refreshing = null;
+        }
+      })();
+    }
+    return this.refreshing;
+  }
+
+  // Resolves with the current snapshot, refreshing it as described above.
+  async getSnapshot() {
+    const snapshot = this.snapshot;
+    const age = snapshot ? this.now() - snapshot.fetchedAt : Infinity;
+
+    if (age < this.ttlMs) {
+      this.counters.hits++;
+      return snapshot;
+    }
+    if (age < this.ttlMs + this.maxStaleMs) {
+      this.counters.staleHits++;
+      this.refresh().catch((error) => {
+        logger.error('Error refreshing posters in the background', { error: error.message });
+      });
+      return snapshot;
+    }
+
+    this.counters.misses++;
+    try {
+      return await this.refresh();
+    } catch (error) {
+      if (snapshot) {
+        logger.error('Error refreshing posters, serving the previous list', { error: error.message });
+        return snapshot;
+      }
+      throw error;
+    }
+  }
+
+  // Returns the serialized body and ETag for one page of a snapshot.
+  getPage(snapshot, page, limit) {
+    const key = `${page}:${limit}`;
+    let view = snapshot.pages.get(key);
+    if (!view) {
+      const total = snapshot.posters.length;
+      const start = (page - 1) * limit;
+      const body = JSON.stringify({
+        posters: snapshot.posters.slice(start, start + limit),
+        page,
+        limit,
+        total,
+        totalPages: Math.ceil(total / limit),
+      });
+      view = { body, etag: etagFor(body) };
+      if (snapshot.pages.size >= MAX_CACHED_PAGES) {
+        snapshot.pages.delete(snapshot.pages.keys().next().value);
+      }
+      snapshot.pages.set(key, view);
+    }
+    return view;
+  }
+
+  /**
+   * Express handler serving the catalogue.
+   *
+   * Without `page`/`limit` query parameters it responds with the full poster array,
+   * as before. With them it responds with { posters, page, limit, total, totalPages }.
+   */
+  handler() {
+    return async (req, res) => {
+      try {
+        const snapshot = await this.getSnapshot();
+
+        let view = snapshot.all;
+        if (req.query.page !== undefined || req.query.limit !== undefined) {
+          const page = Math.max(1, parseInt(req.query.page, 10) || 1);
+          const limit = Math.min(MAX_PAGE_SIZE, Math.max(1, parseInt(req.query.limit, 10) || this.pageSize));
+          view = this.getPage(snapshot, page, limit);
+        }
+
+        res.set({
+          ETag: view.etag,
+          'Cache-Control': `public, max-age=${Math.floor(this.ttlMs / 1000)}, stale-while-revalidate=${Math.floor(this.maxStaleMs / 1000)}`,
+        });
+        if (req.fresh) {
+          return res.status(304).end();
+        }
+        return res.status(200).type('json').send(view.body);
+      } catch (error) {
+        logger.error('Error fetching posters', { error });
+        return res.status(500).json({
+          error: 'Failed to retrieve posters.',
+          details: error.message,
+        });
+      }
+    };
+  }
+
+  // Mirrors the cache counters into a metrics registry (see metrics.js) on every scrape.
+  registerMetrics(registry) {
+    registry.onCollect(() => {
+      const { hits, staleHits, misses, refreshes, refreshErrors } = this.counters;
+      const lookups = registry.counter('poster_cache_lookups_total',
+        'Poster catalogue lookups by result.', { labelNames: ['result'] });
+      lookups.set({ result: 'hit' }, hits);
+      lookups.set({ result: 'stale' }, staleHits);
+      lookups.set({ result: 'miss' }, misses);
+
+      const refreshCount = registry.counter('poster_cache_refreshes_total',
+        'Poster catalogue refreshes from the source by outcome.', { labelNames: ['outcome'] });
+      refreshCount.set({ outcome: 'ok' }, refreshes);
+      refreshCount.set({ outcome: 'error' }, refreshErrors);
+
+      const lookupsTotal = hits + staleHits + misses;
+      registry.gauge('poster_cache_hit_ratio', 'Share of poster lookups served from memory, fresh or stale.')
+        .set({}, lookupsTotal > 0 ? (hits + staleHits) / lookupsTotal : 0);
+      registry.gauge('poster_cache_age_seconds', 'Age of the cached poster list.')
+        .set({}, this.snapshot ? (this.now() - this.snapshot.fetchedAt) / 1000 : 0);
+      registry.gauge('poster_cache_posters', 'Posters in the cached list.')
+        .set({}, this.snapshot ? this.snapshot.posters.length : 0);
+    });
+  }
+
+  stats() {
+    return {
+      posters: this.snapshot ? this.snapshot.posters.length : 0,
+      ageMs: this.snapshot ? this.now() - this.snapshot.fetchedAt : null,
+      ...this.counters,
+    };
+  }
+}
@@ -0,0 +1,116 @@
+/**
+ * @jest-environment node
+ */
+import { logger } from './logger';
+import { PosterCatalogue, createCloudinaryPosterSource, titleFromPublicId } from './posterCatalogue';
+import { cloudinaryDerivativeUrl, posterDerivatives } from './posterImages';
+
+// Local fake of the Cloudinary Search API, serving `count` resources `pageSize` at a time.
+const fakeSearch = (count, pageSize = 2) => {
+  const resources = Array.from({ length: count }, (_, i) => ({
+    public_id: `portfolio/poster_${i}`,
+    secure_url: `https://res.cloudinary.com/demo/image/upload/v1/portfolio/poster_${i}.jpg`,
+    version: 1,
+    width: 1000,
+    height: 1500,
+  }));
+  const search = jest.fn(async ({ cursor }) => {
+    const start = cursor ? Number(cursor) : 0;
+    const end = start + pageSize;
+    return {
+      resources: resources.slice(start, end),
+      next_cursor: end < resources.length ? String(end) : undefined,
+    };
+  });
+  return { search, resources };
+};
+
+test('titles are derived from the public id', () => {
+  expect(titleFromPublicId('portfolio/summer_sale-poster.jpg')).toBe('Summer Sale Poster');
+});
+
+test('the Cloudinary source follows next_cursor to load the whole folder', async () => {
+  const { search } = fakeSearch(5);
+  const source = createCloudinaryPosterSource({ search, folder: 'portfolio' });
+
+  const posters = await source();
+
+  expect(search).toHaveBeenCalledTimes(3);
+  expect(posters).toHaveLength(5);
+  expect(posters[4]).toMatchObject({
+    id: 'portfolio/poster_4',
+    imageUrl: 'https://res.cloudinary.com/demo/image/upload/v1/portfolio/poster_4.jpg',
+    title: 'Poster 4',
+    width: 1000,
+    height: 1500,
+  });
+});
+
+test('stale snapshots are served while a single refresh runs in the background', async () => {
+  let now = 0;
+  const source = jest.fn(async () => [{ id: now }]);
+  const catalogue = new PosterCatalogue({ source, ttlMs: 100, maxStaleMs: 1000, now: () => now });
+
+  const first = await catalogue.getSnapshot();
+  expect(first.posters).toEqual([{ id: 0 }]);
+
+  now = 50;
+  expect(await catalogue.getSnapshot()).toBe(first);
+  expect(source).toHaveBeenCalledTimes(1);
+
+  now = 200;
+  const [a, b] = await Promise.all([catalogue.getSnapshot(), catalogue.getSnapshot()]);
+  expect(a).toBe(first);
+  expect(b).toBe(first);
+  await catalogue.refreshing;
+  expect(source).toHaveBeenCalledTimes(2);
+  expect((await catalogue.getSnapshot()).posters).toEqual([{ id: 200 }]);
+});
+
+test('the previous snapshot is kept when a refresh fails', async () => {
+  let now = 0;
+  const source = jest.fn()
+    .mockResolvedValueOnce([{ id: 'a' }])
+    .mockRejectedValueOnce(new Error('upstream down'));
+  const catalogue = new PosterCatalogue({ source, ttlMs: 10, maxStaleMs: 10, now: () => now });
+  jest.spyOn(logger, 'error').mockImplementation(() => {});
+
+  await catalogue.getSnapshot();
+  now = 100;
+  const snapshot = await catalogue.getSnapshot();
+
+  expect(snapshot.posters).toEqual([{ id: 'a' }]);
+  expect(catalogue.stats().refreshErrors).toBe(1);
+  logger.error.mockRestore();
+});
+
+test('pages are serialized once per snapshot with their own ETag', async () => {
+  const catalogue = new PosterCatalogue({ source: async () => [1, 2, 3, 4, 5] });
+  const snapshot = await catalogue.getSnapshot();
+
+  const page = catalogue.getPage(snapshot, 2, 2);
+
+  expect(JSON.parse(page.body)).toEqual({ posters: [3, 4], page: 2, limit: 2, total: 5, totalPages: 3 });
+  expect(catalogue.getPage(snapshot, 2, 2)).toBe(page);
+  expect(page.etag).not.toBe(snapshot.all.etag);
+});
+
+test('derivative URLs insert the transformation and swap the format offline', () => {
+  const url = 'https://res.cloudinary.com/demo/image/upload/v1/portfolio/poster.jpg';
+
+  expect(cloudinaryDerivativeUrl(url, 'c_limit,w_320,q_auto', 'webp'))
+    .toBe('https://res.cloudinary.com/demo/image/upload/c_limit,w_320,q_auto/v1/portfolio/poster.webp');
+  expect(cloudinaryDerivativeUrl('https://example.com/poster.jpg', 'w_320')).toBe('https://example.com/poster.jpg');
+});
+
+test('srcsets never go wider than the original image', () => {
+  const derivatives = posterDerivatives({
+    secure_url: 'https://res.cloudinary.com/demo/image/upload/v1/portfolio/poster.jpg',
+    width: 700,
+    height: 1000,
+  });
+
+  expect(derivatives.srcset.split(', ').map((entry) => entry.split(' ')[1])).toEqual(['320w', '480w', '640w', '700w']);
+  expect(derivatives.sources.map((source) => source.type)).toEqual(['image/avif', 'image/webp']);
+  expect(derivatives.sources[0].srcset).toContain('/upload/c_limit,w_320,q_auto/v1/portfolio/poster.avif 320w');
+});
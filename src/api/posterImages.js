@@ -0,0 +1,61 @@
+// Widths offered in each srcset, in pixels. Grid tiles use the small ones,
+// the poster modal the large ones.
+const DERIVATIVE_WIDTHS = [320, 480, 640, 960, 1280, 1920];
+
+// Modern formats, best first, as <source> types for a <picture> element.
+const DERIVATIVE_FORMATS = [
+  { format: 'avif', type: 'image/avif' },
+  { format: 'webp', type: 'image/webp' },
+];
+
+// Width of the blurred low-quality placeholder shown while the real image loads.
+const PLACEHOLDER_WIDTH = 24;
+
+/**
+ * Builds a Cloudinary delivery URL for a derivative of an uploaded image.
+ *
+ * Cloudinary generates (and caches on its CDN) the derivative the first time the
+ * URL is requested, so building the URL is pure string work and needs no API call.
+ *
+ * @param {string} secureUrl - The original `secure_url`, e.g. ".../image/upload/v1/portfolio/a.jpg".
+ * @param {string} transformation - Cloudinary transformation, e.g. "c_limit,w_640,q_auto".
+ * @param {string} [format] - Output format extension; keeps the original one when omitted.
+ * @returns {string} The derivative URL.
+ */
+export const cloudinaryDerivativeUrl = (secureUrl, transformation, format) => {
+  const marker = '/upload/';
+  const index = secureUrl.indexOf(marker);
+  if (index === -1) {
+    return secureUrl;
+  }
+
+  const path = secureUrl.slice(index + marker.length);
+  const formattedPath = format ? path.replace(/\.[^./]+$/, `.${format}`) : path;
+  return `${secureUrl.slice(0, index)}${marker}${transformation}/${formattedPath}`;
+};
+
+/**
+ * Describes the responsive derivatives of a Cloudinary image resource.
+ *
+ * @param {object} resource - A Cloudinary search resource (secure_url, width, height).
+ * @returns {object} { width, height, srcset, sources: [{ type, srcset }], placeholder }
+ */
+export const posterDerivatives = (resource) => {
+  const { secure_url: secureUrl, width, height } = resource;
+
+  // Never offer widths larger than the original; it would only be upscaled.
+  const largest = Math.min(width || Infinity, DERIVATIVE_WIDTHS[DERIVATIVE_WIDTHS.length - 1]);
+  const widths = [...DERIVATIVE_WIDTHS.filter((w) => w < largest), largest];
+
+  const srcset = (format) => widths
+    .map((w) => `${cloudinaryDerivativeUrl(secureUrl, `c_limit,w_${w},q_auto`, format)} ${w}w`)
+    .join(', ');
+
+  return {
+    width: width || null,
+    height: height || null,
+    srcset: srcset(),
+    sources: DERIVATIVE_FORMATS.map(({ format, type }) => ({ type, srcset: srcset(format) })),
+    placeholder: cloudinaryDerivativeUrl(secureUrl, `c_limit,w_${PLACEHOLDER_WIDTH},q_auto:low,e_blur:200`),
+  };
+};
@@ -0,0 +1,150 @@
+import crypto from 'crypto';
+import fs from 'fs/promises';
+import path from 'path';
+import { BoundedLru } from './boundedLru.js';
+import { logger } from './logger.js';
+
+// Memory budget and optional disk directory (RESULT_CACHE_* variables).
+const DEFAULT_MAX_ENTRIES = Number(process.env.RESULT_CACHE_MAX_ENTRIES) || 500;
+const DEFAULT_MAX_BYTES = Number(process.env.RESULT_CACHE_MAX_BYTES) || 128 * 1024 * 1024;
+const DEFAULT_DIRECTORY = process.env.RESULT_CACHE_DIR || null;
+
+export const sha256 = (buffer) => crypto.createHash('sha256').update(buffer).digest('hex');
+
+/**
+ * Content-addressed cache for image operation results.
+ *
+ * Results are keyed by a hash of the input bytes plus the normalized operations,
+ * so the same edit on the same photo is found again no matter which handle, upload
+ * or client it came from. There is a memory tier with LRU eviction bounded by entry
+ * count and total bytes, and an optional disk tier under `directory`. The disk tier
+ * is not size-bounded; it is a plain cache directory that can be cleared at any time.
+ */
+export class ResultCache {
+  constructor({
+    maxEntries = DEFAULT_MAX_ENTRIES,
+    maxBytes = DEFAULT_MAX_BYTES,
+    directory = DEFAULT_DIRECTORY,
+  } = {}) {
+    this.maxEntries = maxEntries;
+    this.maxBytes = maxBytes;
+    this.directory = directory;
+    this.entries = new BoundedLru({
+      maxEntries,
+      maxBytes,
+      onEvict: () => {
+        this.counters.evictions++;
+      },
+    });
+    this.counters = {
+      memoryHits: 0,
+      diskHits: 0,
+      misses: 0,
+      evictions: 0,
+      writes: 0,
+      diskErrors: 0,
+    };
+    // Disk writes in progress, by key.
+    this.diskWrites = new Map();
+  }
+
+  /**
+   * Builds the cache key for running `operations` on an input with hash `inputHash`.
+   * Operations must already be normalized (see parseOperations) and must refer to
+   * other images by content hash rather than by handle or upload field.
+   */
+  static key(inputHash, operations) {
+    return sha256(`${inputHash}:${JSON.stringify(operations)}`);
+  }
+
+  filePath(key) {
+    return path.join(this.directory, key.slice(0, 2), key);
+  }
+
+  // Resolves with { buffer, contentType } for a key, or null on a miss.
+  async get(key) {
+    const entry = this.entries.get(key);
+    if (entry) {
+      this.counters.memoryHits++;
+      return entry;
+    }
+
+    if (this.directory) {
+      try {
+        // Disk entries are the content type, a newline, then the image bytes.
+        const file = await fs.readFile(this.filePath(key));
+        const newline = file.indexOf(0x0a);
+        const value = {
+          contentType: file.subarray(0, newline).toString(),
+          buffer: file.subarray(newline + 1),
+        };
+        this.counters.diskHits++;
+        this.remember(key, value);
+        return value;
+      } catch (error) {
+        if (error.code !== 'ENOENT') {
+          this.counters.diskErrors++;
+          logger.error('Error reading result cache entry', { key, error: error.message });
+        }
+      }
+    }
+
+    this.counters.misses++;
+    return null;
+  }
+
+  // Stores a result in memory, and on disk in the background when enabled.
+  set(key, value) {
+    this.remember(key, value);
+    this.counters.writes++;
+
+    if (this.directory && !this.diskWrites.has(key)) {
+      this.writeToDisk(key, value).catch((error) => {
+        this.counters.diskErrors++;
+        logger.error('Error writing result cache entry', { key, error: error.message });
+      });
+    }
+  }
+
+  // Concurrent writes of the same key share one write: entries are content-addressed,
+  // so either result is as good as the other.
+  writeToDisk(key, value) {
+    let write = this.diskWrites.get(key);
+    if (!write) {
+      write = this.writeFile(key, value).finally(() => {
+        this.diskWrites.delete(key);
+      });
+      this.diskWrites.set(key, write);
+    }
+    return write;
+  }
+
+  async writeFile(key, { buffer, contentType }) {
+    const filePath = this.filePath(key);
+    // Unique per write, so writers in other processes never share a temp file.
+    const tempPath = `${filePath}.${crypto.randomBytes(6).toString('hex')}.tmp`;
+    await fs.mkdir(path.dirname(filePath), { recursive: true });
+    await fs.writeFile(tempPath, Buffer.concat([Buffer.from(`${contentType}\n`), buffer]));
+    // Rename is atomic, so readers never see a half-written entry.
+    await fs.rename(tempPath, filePath);
+  }
+
+  // Results larger than the whole memory budget are only kept on disk.
+  remember(key, value) {
+    this.entries.set(key, value);
+  }
+
+  stats() {
+    return {
+      entries: this.entries.size,
+      bytes: this.entries.bytes,
+      maxEntries: this.maxEntries,
+      maxBytes: this.maxBytes,
+      disk: Boolean(this.directory),
+      ...this.counters,
+    };
+  }
+}
+
+// Shared cache used by the image processing handlers.
+export const resultCache = new ResultCache();
@@ -0,0 +1,86 @@
+/**
+ * @jest-environment node
+ */
+import fs from 'fs/promises';
+import os from 'os';
+import path from 'path';
+import { ResultCache } from './resultCache';
+
+const result = (n, contentType = 'image/png') => ({ buffer: Buffer.alloc(n, 7), contentType });
+
+test('keys depend on the input hash and the operations', () => {
+  const operations = [{ op: 'resize', width: 100, height: null, fit: 'cover' }];
+
+  expect(ResultCache.key('abc', operations)).toBe(ResultCache.key('abc', JSON.parse(JSON.stringify(operations))));
+  expect(ResultCache.key('abc', operations)).not.toBe(ResultCache.key('abd', operations));
+  expect(ResultCache.key('abc', operations)).not.toBe(ResultCache.key('abc', []));
+});
+
+test('the memory tier evicts least recently used results by count and by bytes', async () => {
+  const cache = new ResultCache({ maxEntries: 2, maxBytes: 100, directory: null });
+  cache.set('a', result(10));
+  cache.set('b', result(10));
+  await cache.get('a');
+  cache.set('c', result(10));
+
+  expect(await cache.get('b')).toBe(null);
+  expect((await cache.get('a')).buffer.length).toBe(10);
+
+  cache.set('d', result(95));
+  expect(await cache.get('a')).toBe(null);
+  expect(await cache.get('c')).toBe(null);
+  expect(cache.stats()).toMatchObject({ entries: 1, bytes: 95, evictions: 3, memoryHits: 2, misses: 3 });
+});
+
+test('results larger than the memory budget are not kept in memory', async () => {
+  const cache = new ResultCache({ maxEntries: 10, maxBytes: 100, directory: null });
+  cache.set('big', result(101));
+
+  expect(await cache.get('big')).toBe(null);
+  expect(cache.stats()).toMatchObject({ entries: 0, bytes: 0, writes: 1 });
+});
+
+test('the disk tier stores the content type with the bytes and survives a restart', async () => {
+  const directory = await fs.mkdtemp(path.join(os.tmpdir(), 'result-cache-'));
+  try {
+    const key = ResultCache.key('input', [{ op: 'format', format: 'webp' }]);
+    const writer = new ResultCache({ maxEntries: 10, maxBytes: 1000, directory });
+    await writer.writeToDisk(key, result(12, 'image/webp'));
+
+    // A new cache (e.g. after a restart) finds the entry on disk, then keeps it in memory.
+    const reader = new ResultCache({ maxEntries: 10, maxBytes: 1000, directory });
+    const fromDisk = await reader.get(key);
+    expect(fromDisk.contentType).toBe('image/webp');
+    expect(fromDisk.buffer.equals(Buffer.alloc(12, 7))).toBe(true);
+
+    await reader.get(key);
+    expect(await reader.get('missing')).toBe(null);
+    expect(reader.stats()).toMatchObject({ diskHits: 1, memoryHits: 1, misses: 1, diskErrors: 0 });
+
+    const files = await fs.readdir(path.join(directory, key.slice(0, 2)));
+    expect(files).toEqual([key]);
+  } finally {
+    await fs.rm(directory, { recursive: true, force: true });
+  }
+});
+
+test('concurrent writes of the same result share one write and never collide', async () => {
+  const directory = await fs.mkdtemp(path.join(os.tmpdir(), 'result-cache-'));
+  try {
+    const key = ResultCache.key('same-preset', []);
+    const cache = new ResultCache({ maxEntries: 10, maxBytes: 1000, directory });
+    const other = new ResultCache({ maxEntries: 10, maxBytes: 1000, directory });
+
+    cache.set(key, result(8));
+    cache.set(key, result(8));
+    expect(cache.diskWrites.size).toBe(1);
+
+    // A second cache (another worker process) writes the same entry at the same time.
+    await Promise.all([cache.writeToDisk(key, result(8)), other.writeToDisk(key, result(8))]);
+    expect(cache.diskWrites.size).toBe(0);
+    expect(cache.stats()).toMatchObject({ writes: 2, diskErrors: 0 });
+    expect(await fs.readdir(path.join(directory, key.slice(0, 2)))).toEqual([key]);
+  } finally {
+    await fs.rm(directory, { recursive: true, force: true });
+  }
+});
@@ -0,0 +1,358 @@
+import sharp from 'sharp';
+import { percentile } from './jobQueue.js';
+import { logger } from './logger.js';
+
+// Model settings (SEGMENTATION_* variables). The defaults suit U^2-Net
+// style salient-object models (e.g. u2netp.onnx): a square RGB input normalized
+// with the ImageNet mean/std, and a single-channel saliency map as output.
+const MODEL_PATH = process.env.SEGMENTATION_MODEL_PATH || null;
+const MODEL_SIZE = Number(process.env.SEGMENTATION_MODEL_SIZE) || 320;
+const MODEL_THREADS = Number(process.env.SEGMENTATION_THREADS) || 0; // 0 = let onnxruntime decide
+const BATCH_WINDOW_MS = Number(process.env.SEGMENTATION_BATCH_WINDOW_MS) || 10;
+const MAX_BATCH = Number(process.env.SEGMENTATION_MAX_BATCH) || 4;
+const MEAN = [0.485, 0.456, 0.406];
+const STD = [0.229, 0.224, 0.225];
+
+// Colour-key defaults: how far (RGB distance) a pixel may be from the background
+// colour and still count as background, and the width of the soft edge beyond that.
+const DEFAULT_TOLERANCE = 40;
+const DEFAULT_FEATHER = 24;
+// Longest edge the colour-key flood fill runs at. It is synchronous JavaScript, so
+// larger images are keyed on a downscaled copy and the mask is upsampled.
+const COLORKEY_MAX_SIZE = 1024;
+
+// How many recent latency samples to keep per mode.
+const SAMPLE_SIZE = 200;
+
+export const REMOVAL_MODES = ['auto', 'segment', 'colorkey'];
+
+let batcher = null;
+
+const modeStats = {
+  segment: { count: 0, samples: [], completedAt: [], batches: 0, batchedImages: 0 },
+  colorkey: { count: 0, samples: [], completedAt: [] },
+};
+
+const recordLatency = (mode, ms) => {
+  const stats = modeStats[mode];
+  stats.count++;
+  stats.samples.push(ms);
+  stats.completedAt.push(Date.now());
+  if (stats.samples.length > SAMPLE_SIZE) {
+    stats.samples.shift();
+    stats.completedAt.shift();
+  }
+};
+
+/**
+ * Groups concurrent inference requests that arrive within `windowMs` of each
+ * other into one batched model run, so throughput scales with load instead of
+ * paying the per-run overhead for every image.
+ */
+class SegmentationBatcher {
+  constructor({ ort, session, size, windowMs, maxBatch }) {
+    this.ort = ort;
+    this.session = session;
+    this.size = size;
+    this.windowMs = windowMs;
+    this.maxBatch = maxBatch;
+    this.pending = [];
+    this.timer = null;
+  }
+
+  // Resolves with the raw model output (size x size floats) for one preprocessed image.
+  infer(input) {
+    return new Promise((resolve, reject) => {
+      this.pending.push({ input, resolve, reject });
+      if (this.pending.length >= this.maxBatch) {
+        this.flush();
+      } else if (!this.timer) {
+        this.timer = setTimeout(() => this.flush(), this.windowMs);
+      }
+    });
+  }
+
+  flush() {
+    clearTimeout(this.timer);
+    this.timer = null;
+    const batch = this.pending.splice(0, this.maxBatch);
+    if (batch.length > 0) {
+      this.runBatch(batch);
+    }
+    if (this.pending.length > 0) {
+      this.timer = setTimeout(() => this.flush(), this.windowMs);
+    }
+  }
+
+  async runBatch(batch) {
+    const pixels = this.size * this.size;
+    try {
+      const data = new Float32Array(batch.length * 3 * pixels);
+      batch.forEach(({ input }, i) => data.set(input, i * 3 * pixels));
+
+      const feeds = {
+        [this.session.inputNames[0]]: new this.ort.Tensor('float32', data, [batch.length, 3, this.size, this.size]),
+      };
+      const results = await this.session.run(feeds);
+      const output = results[this.session.outputNames[0]].data;
+
+      modeStats.segment.batches++;
+      modeStats.segment.batchedImages += batch.length;
+      batch.forEach(({ resolve }, i) => resolve(output.subarray(i * pixels, (i + 1) * pixels)));
+    } catch (error) {
+      if (batch.length > 1) {
+        // Some exported models have a fixed batch size of 1: stop batching and retry one by one.
+        logger.warn('Batched segmentation failed, falling back to single-image batches', { error: error.message });
+        this.maxBatch = 1;
+        batch.forEach((item) => this.runBatch([item]));
+        return;
+      }
+      batch.forEach(({ reject }) => reject(error));
+    }
+  }
+}
+
+/**
+ * Loads the segmentation model once, at startup.
+ *
+ * Needs SEGMENTATION_MODEL_PATH to point at an ONNX model and the optional
+ * `onnxruntime-node` package to be installed. Without either, segmentation is
+ * unavailable and background removal uses the colour-key mode.
+ *
+ * @returns {Promise<boolean>} Whether the model was loaded.
+ */
+export const loadSegmentationModel = async () => {
+  if (!MODEL_PATH) {
+    return false;
+  }
+
+  try {
+    const ort = await import('onnxruntime-node');
+    const session = await ort.InferenceSession.create(MODEL_PATH, {
+      executionProviders: ['cpu'],
+      graphOptimizationLevel: 'all',
+      ...(MODEL_THREADS ? { intraOpNumThreads: MODEL_THREADS } : {}),
+    });
+    batcher = new SegmentationBatcher({
+      ort,
+      session,
+      size: MODEL_SIZE,
+      windowMs: BATCH_WINDOW_MS,
+      maxBatch: MAX_BATCH,
+    });
+    logger.info('Segmentation model loaded', { path: MODEL_PATH, size: MODEL_SIZE });
+    return true;
+  } catch (error) {
+    logger.error('Could not load the segmentation model, using colour-key background removal', {
+      path: MODEL_PATH,
+      error: error.message,
+    });
+    return false;
+  }
+};
+
+export const isSegmentationAvailable = () => batcher !== null;
+
+// Resolves the `auto` mode to the best mode this server can run.
+export const resolveRemovalMode = (mode = 'auto') => {
+  if (mode === 'auto') {
+    return isSegmentationAvailable() ? 'segment' : 'colorkey';
+  }
+  return mode;
+};
+
+// Alpha mask from the segmentation model: the image is downscaled to the model's
+// resolution, and the predicted mask is upsampled back to the full size.
+const segmentationMask = async (data, width, height, channels) => {
+  const size = batcher.size;
+  const small = await sharp(data, { raw: { width, height, channels } })
+    .removeAlpha()
+    .resize(size, size, { fit: 'fill' })
+    .raw()
+    .toBuffer();
+
+  // HWC bytes -> normalized CHW floats.
+  const pixels = size * size;
+  const input = new Float32Array(3 * pixels);
+  for (let i = 0; i < pixels; i++) {
+    for (let c = 0; c < 3; c++) {
+      input[c * pixels + i] = (small[i * 3 + c] / 255 - MEAN[c]) / STD[c];
+    }
+  }
+
+  const output = await batcher.infer(input);
+
+  // Stretch the prediction to 0-255.
+  let min = Infinity;
+  let max = -Infinity;
+  for (let i = 0; i < pixels; i++) {
+    min = Math.min(min, output[i]);
+    max = Math.max(max, output[i]);
+  }
+  const range = max - min || 1;
+  const mask = Buffer.alloc(pixels);
+  for (let i = 0; i < pixels; i++) {
+    mask[i] = Math.round(((output[i] - min) / range) * 255);
+  }
+
+  return sharp(mask, { raw: { width: size, height: size, channels: 1 } })
+    .resize(width, height, { fit: 'fill', kernel: 'cubic' })
+    .raw()
+    .toBuffer();
+};
+
+// Alpha mask for images on a (roughly) uniform background: the background colour
+// is taken from the border, and pixels close to it that are connected to the
+// border are made transparent, with a soft edge of `feather` beyond `tolerance`.
+const colorKeyMask = (data, width, height, channels, { tolerance, feather }) => {
+  // Median of the border pixels, per channel.
+  const border = [[], [], []];
+  const step = Math.max(1, Math.floor((2 * (width + height)) / 2000));
+  const sample = (x, y) => {
+    const p = (y * width + x) * channels;
+    border[0].push(data[p]);
+    border[1].push(data[p + 1]);
+    border[2].push(data[p + 2]);
+  };
+  for (let x = 0; x < width; x += step) {
+    sample(x, 0);
+    sample(x, height - 1);
+  }
+  for (let y = 0; y < height; y += step) {
+    sample(0, y);
+    sample(width - 1, y);
+  }
+  const [r, g, b] = border.map((values) => values.sort((a, c) => a - c)[Math.floor(values.length / 2)]);
+
+  const limit = tolerance + feather;
+  const alphaAt = (i) => {
+    const p = i * channels;
+    const distance = Math.sqrt((data[p] - r) ** 2 + (data[p + 1] - g) ** 2 + (data[p + 2] - b) ** 2);
+    if (distance <= tolerance) {
+      return 0;
+    }
+    return distance >= limit ? 255 : Math.round(((distance - tolerance) / feather) * 255);
+  };
+
+  // Flood fill from the border through background-coloured pixels.
+  const mask = Buffer.alloc(width * height, 255);
+  const visited = new Uint8Array(width * height);
+  const queue = new Int32Array(width * height);
+  let head = 0;
+  let tail = 0;
+  const visit = (i) => {
+    if (visited[i]) {
+      return;
+    }
+    visited[i] = 1;
+    const alpha = alphaAt(i);
+    if (alpha < 255) {
+      mask[i] = alpha;
+      queue[tail++] = i;
+    }
+  };
+  for (let x = 0; x < width; x++) {
+    visit(x);
+    visit((height - 1) * width + x);
+  }
+  for (let y = 0; y < height; y++) {
+    visit(y * width);
+    visit(y * width + width - 1);
+  }
+  while (head < tail) {
+    const i = queue[head++];
+    const x = i % width;
+    if (x > 0) {
+      visit(i - 1);
+    }
+    if (x < width - 1) {
+      visit(i + 1);
+    }
+    if (i >= width) {
+      visit(i - width);
+    }
+    if (i < width * (height - 1)) {
+      visit(i + width);
+    }
+  }
+  return mask;
+};
+
+// Colour-key mask at the image's full size. Images larger than COLORKEY_MAX_SIZE
+// are keyed on a downscaled copy, like segmentationMask, and the mask upsampled.
+const scaledColorKeyMask = async (data, width, height, channels, options) => {
+  const scale = COLORKEY_MAX_SIZE / Math.max(width, height);
+  if (scale >= 1) {
+    return colorKeyMask(data, width, height, channels, options);
+  }
+
+  const smallWidth = Math.max(1, Math.round(width * scale));
+  const smallHeight = Math.max(1, Math.round(height * scale));
+  const small = await sharp(data, { raw: { width, height, channels } })
+    .removeAlpha()
+    .resize(smallWidth, smallHeight, { fit: 'fill' })
+    .raw()
+    .toBuffer();
+  const mask = colorKeyMask(small, smallWidth, smallHeight, 3, options);
+
+  return sharp(mask, { raw: { width: smallWidth, height: smallHeight, channels: 1 } })
+    .resize(width, height, { fit: 'fill', kernel: 'cubic' })
+    .raw()
+    .toBuffer();
+};
+
+/**
+ * Makes the background of a decoded RGBA image transparent, in place.
+ *
+ * @param {Buffer} data - Raw RGBA pixels (4 channels).
+ * @param {number} width
+ * @param {number} height
+ * @param {object} options - { mode: 'segment' | 'colorkey', tolerance?, feather? }
+ * @returns {Promise<Buffer>} The same buffer, with its alpha channel replaced.
+ */
+export const removeBackground = async (data, width, height, { mode, tolerance, feather }) => {
+  const start = process.hrtime.bigint();
+  const channels = 4;
+
+  const mask = mode === 'segment'
+    ? await segmentationMask(data, width, height, channels)
+    : await scaledColorKeyMask(data, width, height, channels, {
+      tolerance: tolerance || DEFAULT_TOLERANCE,
+      feather: feather || DEFAULT_FEATHER,
+    });
+
+  // Keep any transparency the image already had.
+  for (let i = 0; i < width * height; i++) {
+    const p = i * channels + 3;
+    data[p] = Math.min(data[p], mask[i]);
+  }
+
+  recordLatency(mode, Number(process.hrtime.bigint() - start) / 1e6);
+  return data;
+};
+
+// Latency and throughput per removal mode. Throughput is measured over the wall-clock
+// span of the recent completions, so it reflects batching under concurrent load.
+export const segmentationStats = () => {
+  const summarize = ({ count, samples, completedAt }) => {
+    const spanMs = completedAt.length > 1 ? completedAt[completedAt.length - 1] - completedAt[0] : 0;
+    return {
+      count,
+      p50Ms: percentile(samples, 50),
+      p95Ms: percentile(samples, 95),
+      imagesPerSecond: spanMs > 0 ? ((completedAt.length - 1) * 1000) / spanMs : 0,
+    };
+  };
+
+  return {
+    modelLoaded: isSegmentationAvailable(),
+    segment: {
+      ...summarize(modeStats.segment),
+      batches: modeStats.segment.batches,
+      averageBatchSize: modeStats.segment.batches > 0
+        ? modeStats.segment.batchedImages / modeStats.segment.batches
+        : 0,
+    },
+    colorkey: summarize(modeStats.colorkey),
+  };
+};
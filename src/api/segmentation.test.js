@@ -0,0 +1,77 @@
+/**
+ * @jest-environment node
+ */
+import { removeBackground, segmentationStats } from './segmentation';
+
+const WHITE = [255, 255, 255, 255];
+const RED = [200, 20, 20, 255];
+
+// Raw RGBA pixels from a list of rows of [r, g, b, a] values.
+const image = (rows) => ({
+  data: Buffer.from(rows.flat(2)),
+  width: rows[0].length,
+  height: rows.length,
+});
+
+const alphas = ({ data, width }) => {
+  const rows = [];
+  for (let p = 3; p < data.length; p += 4) {
+    const i = (p - 3) / 4;
+    if (i % width === 0) {
+      rows.push([]);
+    }
+    rows[rows.length - 1].push(data[p]);
+  }
+  return rows;
+};
+
+const colorKey = async (input, options = {}) => {
+  await removeBackground(input.data, input.width, input.height, { mode: 'colorkey', ...options });
+  return alphas(input);
+};
+
+test('the border colour is cleared and the subject kept', async () => {
+  const countBefore = segmentationStats().colorkey.count;
+  const input = image([
+    [WHITE, WHITE, WHITE, WHITE, WHITE],
+    [WHITE, RED, RED, RED, WHITE],
+    [WHITE, RED, WHITE, RED, WHITE],
+    [WHITE, RED, RED, RED, WHITE],
+    [WHITE, WHITE, WHITE, WHITE, WHITE],
+  ]);
+
+  // The white pixel inside the subject isn't connected to the border, so it stays.
+  expect(await colorKey(input)).toEqual([
+    [0, 0, 0, 0, 0],
+    [0, 255, 255, 255, 0],
+    [0, 255, 255, 255, 0],
+    [0, 255, 255, 255, 0],
+    [0, 0, 0, 0, 0],
+  ]);
+  expect(segmentationStats().colorkey.count).toBe(countBefore + 1);
+});
+
+test('pixels that were already transparent stay transparent', async () => {
+  const input = image([
+    [WHITE, WHITE, WHITE, WHITE],
+    [WHITE, [200, 20, 20, 0], [200, 20, 20, 90], WHITE],
+    [[255, 255, 255, 40], RED, RED, WHITE],
+    [WHITE, WHITE, WHITE, WHITE],
+  ]);
+
+  expect(await colorKey(input)).toEqual([
+    [0, 0, 0, 0],
+    [0, 0, 90, 0],
+    [0, 255, 255, 0],
+    [0, 0, 0, 0],
+  ]);
+});
+
+test('tolerance and feather set where the soft edge starts and how wide it is', async () => {
+  // Pixels 30, 52 and 100 away from the white background (red channel only).
+  const row = () => image([[WHITE, WHITE, WHITE, [225, 255, 255, 255], [203, 255, 255, 255], [155, 255, 255, 255]]]);
+
+  expect(await colorKey(row())).toEqual([[0, 0, 0, 0, 128, 255]]);
+  expect(await colorKey(row(), { tolerance: 60 })).toEqual([[0, 0, 0, 0, 0, 255]]);
+  expect(await colorKey(row(), { tolerance: 40, feather: 100 })).toEqual([[0, 0, 0, 0, 31, 153]]);
+});
@@ -0,0 +1,76 @@
+import { AsyncLocalStorage } from 'async_hooks';
+import crypto from 'crypto';
+import { logger } from './logger.js';
+import { metrics } from './metrics.js';
+
+// W3C trace context header: version-traceId-parentSpanId-flags.
+const TRACEPARENT = /^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$/;
+
+const traceStorage = new AsyncLocalStorage();
+
+const randomId = (bytes) => crypto.randomBytes(bytes).toString('hex');
+
+const spanDuration = metrics.histogram('trace_span_duration_seconds',
+  'Duration of traced operations (upstream calls) by span name and outcome.',
+  { labelNames: ['span', 'outcome'] });
+
+// The trace of the request (or span) currently running, if any.
+export const currentTrace = () => traceStorage.getStore() || null;
+
+// Creates the trace context for an incoming request, continuing the caller's trace
+// when it sent a valid `traceparent` header.
+export const startTrace = (traceparent) => {
+  const match = TRACEPARENT.exec(traceparent || '');
+  return {
+    traceId: match ? match[1] : randomId(16),
+    spanId: randomId(8),
+    parentSpanId: match ? match[2] : null,
+  };
+};
+
+// Runs `fn` (and everything it starts asynchronously) inside `trace`.
+export const runInTrace = (trace, fn) => traceStorage.run(trace, fn);
+
+/**
+ * Runs an async operation as a child span of the current trace.
+ *
+ * The span's duration is recorded in the `trace_span_duration_seconds` histogram
+ * and a structured `span` log line carries the trace and span ids, so a slow
+ * request can be matched to the upstream call that made it slow.
+ *
+ * @param {string} name - Span name, e.g. "cloudinary.search".
+ * @param {object} attributes - Extra fields for the span log line.
+ * @param {function} fn - The async operation.
+ * @returns {Promise<*>} Whatever `fn` resolves with.
+ */
+export const traceSpan = async (name, attributes, fn) => {
+  const parent = currentTrace();
+  const span = {
+    traceId: parent ? parent.traceId : randomId(16),
+    spanId: randomId(8),
+    parentSpanId: parent ? parent.spanId : null,
+  };
+  const start = process.hrtime.bigint();
+  let failure = null;
+
+  try {
+    return await traceStorage.run(span, fn);
+  } catch (error) {
+    failure = error;
+    throw error;
+  } finally {
+    const seconds = Number(process.hrtime.bigint() - start) / 1e9;
+    const outcome = failure ? 'error' : 'ok';
+    spanDuration.observe({ span: name, outcome }, seconds);
+    logger.log(failure ? 'warn' : 'info', 'span', {
+      span: name,
+      trace_id: span.traceId,
+      span_id: span.spanId,
+      parent_span_id: span.parentSpanId,
+      duration_ms: Math.round(seconds * 1e6) / 1e3,
+      outcome,
+      ...attributes,
+      ...(failure ? { error: failure.message } : {}),
+    });
+  }
+};
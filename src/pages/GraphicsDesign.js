@@ -80,6 +80,40 @@ const VideoEditing = ({ onBack }) => {
   );
 };
 
+// ResponsivePosterImage Component
+// Renders a poster with the AVIF/WebP width variants returned by /api/posters, so the
+// browser downloads a size that fits the tile. Intrinsic width/height reserve the
+// layout space, and the blurred placeholder shows until the real image arrives (it
+// is then removed, so it can't show through transparent areas of PNG posters).
+// Posters without derivatives (e.g. from the Apps Script backend) fall back to imageUrl.
+const ResponsivePosterImage = ({ poster, sizes, className, alt, loading = 'lazy' }) => {
+  const [loaded, setLoaded] = useState(false);
+  const placeholderStyle = poster.placeholder && !loaded
+    ? { backgroundImage: `url(${poster.placeholder})`, backgroundSize: 'cover', backgroundPosition: 'center' }
+    : undefined;
+
+  return (
+    <picture>
+      {(poster.sources || []).map((source) => (
+        <source key={source.type} type={source.type} srcSet={source.srcset} sizes={sizes} />
+      ))}
+      <img
+        src={poster.imageUrl}
+        srcSet={poster.srcset}
+        sizes={poster.srcset ? sizes : undefined}
+        width={poster.width || undefined}
+        height={poster.height || undefined}
+        loading={loading}
+        decoding="async"
+        style={placeholderStyle}
+        onLoad={() => setLoaded(true)}
+        className={className}
+        alt={alt}
+      />
+    </picture>
+  );
+};
+
 // PosterGallery Component
 const PosterGallery = ({ onBack }) => {
   const [posters, setPosters] = useState([]);
@@ -208,8 +242,10 @@ const PosterGallery = ({ onBack }) => {
               className="bg-[#1C2C59] rounded-xl p-4 shadow-lg border border-[#4CAF50] cursor-pointer hover:scale-105 transition-transform duration-200"
               onClick={() => openPosterModal(poster)}
             >
-              <img
-                src={poster.imageUrl}
+              <ResponsivePosterImage
+                poster={poster}
+                // 1 column on mobile, 2 from md, 3 from lg inside a max-w-5xl (1024px) container
+                sizes="(min-width: 1024px) 320px, (min-width: 768px) 50vw, 100vw"
                 className="w-full h-64 object-cover rounded-md mb-4"
                 alt={poster.title || 'Portfolio Image'}
               />
@@ -241,10 +277,13 @@ const PosterGallery = ({ onBack }) => {
             >
               &times;
             </button>
-            <img
-              src={selectedPoster.imageUrl}
+            <ResponsivePosterImage
+              key={selectedPoster.id}
+              poster={selectedPoster}
+              sizes="(min-width: 896px) 896px, 100vw"
+              loading="eager"
+              className="max-w-full max-h-[85vh] w-auto h-auto object-contain rounded-lg"
               alt={selectedPoster.title || 'Selected Poster'}
-              className="max-w-full max-h-[85vh] object-contain rounded-lg"
             />
             {selectedPoster.title && (
               <div className="absolute bottom-0 left-0 right-0 bg-gradient-to-t from-black to-transparent p-4 text-white text-lg font-semibold text-center">
@@ -6,11 +6,13 @@ const App = () => {
     const [originalImage, setOriginalImage] = useState(null);
     // State for the URL of the original image preview (will be data URL now)
     const [originalImagePreview, setOriginalImagePreview] = useState(null);
-    // State for the URL of the processed image (data URL)
+    // State for the URL of the processed image (served from the backend image store)
     const [processedImage, setProcessedImage] = useState(null);
-    // State to store the Base64 image data currently being processed on the backend
-    // This is crucial as it's passed back and forth for chained operations.
-    const [currentImageData, setCurrentImageData] = useState(null);
+    // State to store the handle of the image currently being processed on the backend
+    // Chained operations only send this handle instead of re-uploading the image.
+    const [currentImageHandle, setCurrentImageHandle] = useState(null);
+    // State for previous { handle, previewUrl } pairs, used by "Undo"
+    const [imageHistory, setImageHistory] = useState([]);
     // State for the selected background color
     const [backgroundColor, setBackgroundColor] = useState('#000000'); // Default to black
     // State for the uploaded background image file (for local preview)
@@ -61,7 +63,8 @@ const App = () => {
         if (file && file.type.startsWith('image/')) {
             setOriginalImage(file); // For local preview
             setProcessedImage(null); // Reset processed image
-            setCurrentImageData(null); // Reset current image data
+            setCurrentImageHandle(null); // Reset current image handle
+            setImageHistory([]);
             setMessage('');
 
             setIsLoading(true);
@@ -71,15 +74,16 @@ const App = () => {
 
             try {
                 // IMPORTANT: Changed endpoint to /api/upload for the Node.js backend
-                const response = await fetch(`/api/upload`, {
+                // include_data=false: we only need the handle and preview URL, not the Base64 image
+                const response = await fetch(`/api/upload?include_data=false`, {
                     method: 'POST',
                     body: formData,
                 });
                 const result = await response.json();
                 if (response.ok) {
                     setMessage(result.message);
-                    setCurrentImageData(result.image_data); // Store Base64 string from backend
-                    setProcessedImage(`data:image/png;base64,${result.image_data}`);
+                    setCurrentImageHandle(result.image_handle); // Store image handle from backend
+                    setProcessedImage(result.preview_url);
                 } else {
                     setMessage(`Upload Error: ${result.error || 'Failed to upload image.'}`);
                     setOriginalImage(null);
@@ -112,7 +116,7 @@ const App = () => {
 
     // Helper function to make actual API calls to the Node.js backend
     const makeRealApiCall = async (endpoint, data) => {
-        if (!currentImageData && endpoint !== '/api/upload') { // Only allow /api/upload without currentImageData
+        if (!currentImageHandle && endpoint !== '/api/upload') { // Only allow /api/upload without currentImageHandle
             setMessage('Please upload an image first.');
             setIsLoading(false);
             return null;
@@ -122,16 +126,17 @@ const App = () => {
         setMessage(`Processing via ${endpoint}...`);
 
         let bodyToSend = new FormData();
-        // Always send the current image data (Base64 string) for subsequent operations
-        if (currentImageData) {
-            bodyToSend.append('image_data', currentImageData);
+        // Always send the current image handle for subsequent operations
+        if (currentImageHandle) {
+            bodyToSend.append('image_handle', currentImageHandle);
         }
+        bodyToSend.append('include_data', 'false');
 
         // Append other data specific to the operation
         if (data instanceof FormData) {
             for (let pair of data.entries()) {
-                // Ensure we don't duplicate 'image_data' if it's already added
-                if (pair[0] !== 'image_data') {
+                // Ensure we don't duplicate 'image_handle' if it's already added
+                if (pair[0] !== 'image_handle') {
                     bodyToSend.append(pair[0], pair[1]);
                 }
             }
@@ -151,9 +156,11 @@ const App = () => {
             const result = await response.json();
             if (response.ok) {
                 setMessage(result.message || 'Operation successful!');
-                if (result.image_data) {
-                    setCurrentImageData(result.image_data); // Update with new Base64 string
-                    setProcessedImage(`data:image/png;base64,${result.image_data}`);
+                if (result.image_handle) {
+                    // Remember the current image so the operation can be undone
+                    setImageHistory((history) => [...history, { handle: currentImageHandle, previewUrl: processedImage }]);
+                    setCurrentImageHandle(result.image_handle); // Update with new image handle
+                    setProcessedImage(result.preview_url);
                 }
                 return result;
             } else {
@@ -171,7 +178,7 @@ const App = () => {
 
     // Handler for "Remove Background" button click
     const handleRemoveBackground = async () => {
-        if (!currentImageData) {
+        if (!currentImageHandle) {
             setMessage('Please upload an image first.');
             return;
         }
@@ -180,7 +187,7 @@ const App = () => {
 
     // Handler for "Apply Solid Color Background" button click
     const handleApplySolidColor = async () => {
-        if (!currentImageData) {
+        if (!currentImageHandle) {
             setMessage('Please upload an image first.');
             return;
         }
@@ -192,7 +199,7 @@ const App = () => {
 
     // Handler for "Apply Image Background" button click
     const handleApplyImageBackground = async () => {
-        if (!currentImageData || !backgroundImage) {
+        if (!currentImageHandle || !backgroundImage) {
             setMessage('Please upload an original image (first) and a background image.');
             return;
         }
@@ -202,24 +209,50 @@ const App = () => {
         await makeRealApiCall('/api/edit-background', formData);
     };
 
+    // Handler for "Undo" button click - goes back to the previous image handle.
+    // Repeating the same operation afterwards is served from the backend's cache.
+    const handleUndo = () => {
+        if (imageHistory.length === 0) {
+            return;
+        }
+        const previous = imageHistory[imageHistory.length - 1];
+        setImageHistory(imageHistory.slice(0, -1));
+        setCurrentImageHandle(previous.handle);
+        setProcessedImage(previous.previewUrl);
+        setMessage('Last operation undone.');
+    };
+
     // Handler for "Download Image" button click
-    const handleDownloadImage = () => {
+    const handleDownloadImage = async () => {
         if (!processedImage) {
             setMessage('No image to download. Please process an image first.');
             return;
         }
-        const link = document.createElement('a');
-        link.href = processedImage;
-        link.download = `processed_image_${resizeOption}.png`;
-        document.body.appendChild(link);
-        link.click();
-        document.body.removeChild(link);
-        setMessage('Image downloaded!');
+        try {
+            // Fetch the stored image so the download goes through the API (and its proxy)
+            const response = await fetch(processedImage);
+            if (!response.ok) {
+                setMessage('Error: The processed image has expired. Please upload it again.');
+                return;
+            }
+            const objectUrl = URL.createObjectURL(await response.blob());
+            const link = document.createElement('a');
+            link.href = objectUrl;
+            link.download = `processed_image_${resizeOption}.png`;
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+            URL.revokeObjectURL(objectUrl);
+            setMessage('Image downloaded!');
+        } catch (error) {
+            console.error('Download failed:', error);
+            setMessage(`Network Error: Could not download the image. ${error.message}`);
+        }
     };
 
     // Handler for "Resize Image" button click
     const handleResizeImage = async () => {
-        if (!currentImageData) {
+        if (!currentImageHandle) {
             setMessage('Please upload an image first to resize.');
             return;
         }
@@ -317,9 +350,9 @@ const App = () => {
                     <p className={`mb-3 sm:mb-4 text-sm sm:text-base ${colors.text}`}>Click to remove the background from your uploaded image.</p>
                     <button
                         onClick={handleRemoveBackground}
-                        disabled={!currentImageData || isLoading}
+                        disabled={!currentImageHandle || isLoading}
                         className={`w-full py-2 sm:py-3 px-4 sm:px-6 rounded-full font-semibold transition-all duration-300 ${colors.button} ${colors.text} shadow-md
-                                ${(!currentImageData || isLoading) ? 'opacity-50 cursor-not-allowed' : colors.buttonHover}`}
+                                ${(!currentImageHandle || isLoading) ? 'opacity-50 cursor-not-allowed' : colors.buttonHover}`}
                     >
                         {isLoading ? 'Processing...' : 'Remove Background'}
                     </button>
@@ -352,9 +385,9 @@ const App = () => {
                             <span className={`${colors.text} text-sm sm:text-base`}>{backgroundColor.toUpperCase()}</span>
                             <button
                                 onClick={handleApplySolidColor}
-                                disabled={!currentImageData || isLoading}
+                                disabled={!currentImageHandle || isLoading}
                                 className={`flex-grow py-2 px-4 rounded-full font-semibold transition-all duration-300 ${colors.button} ${colors.text} shadow-md
-                                        ${(!currentImageData || isLoading) ? 'opacity-50 cursor-not-allowed' : colors.buttonHover}`}
+                                        ${(!currentImageHandle || isLoading) ? 'opacity-50 cursor-not-allowed' : colors.buttonHover}`}
                             >
                                 Apply Color
                             </button>
@@ -389,9 +422,9 @@ const App = () => {
                         )}
                         <button
                             onClick={handleApplyImageBackground}
-                            disabled={!currentImageData || !backgroundImage || isLoading}
+                            disabled={!currentImageHandle || !backgroundImage || isLoading}
                             className={`w-full py-2 sm:py-3 px-4 sm:px-6 rounded-full font-semibold transition-all duration-300 ${colors.button} ${colors.text} shadow-md
-                                ${(!currentImageData || !backgroundImage || isLoading) ? 'opacity-50 cursor-not-allowed' : colors.buttonHover}`}
+                                ${(!currentImageHandle || !backgroundImage || isLoading) ? 'opacity-50 cursor-not-allowed' : colors.buttonHover}`}
                         >
                             Apply Image
                         </button>
@@ -458,13 +491,22 @@ const App = () => {
 
                     <button
                         onClick={handleResizeImage}
-                        disabled={!currentImageData || isLoading}
+                        disabled={!currentImageHandle || isLoading}
                         className={`w-full py-2 sm:py-3 px-4 sm:px-6 rounded-full font-semibold transition-all duration-300 mb-4 sm:mb-6 ${colors.button} ${colors.text} shadow-md
-                                ${(!currentImageData || isLoading) ? 'opacity-50 cursor-not-allowed' : colors.buttonHover}`}
+                                ${(!currentImageHandle || isLoading) ? 'opacity-50 cursor-not-allowed' : colors.buttonHover}`}
                     >
                         {isLoading ? 'Resizing...' : 'Apply Resize'}
                     </button>
 
+                    <button
+                        onClick={handleUndo}
+                        disabled={imageHistory.length === 0 || isLoading}
+                        className={`w-full py-2 sm:py-3 px-4 sm:px-6 rounded-full font-semibold transition-all duration-300 mb-4 sm:mb-6 ${colors.button} ${colors.text} shadow-md
+                                ${(imageHistory.length === 0 || isLoading) ? 'opacity-50 cursor-not-allowed' : colors.buttonHover}`}
+                    >
+                        Undo Last Operation
+                    </button>
+
                     <button
                         onClick={handleDownloadImage}
                         disabled={!processedImage || isLoading}